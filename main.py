@@ -6,6 +6,10 @@ from src.eic import *
 from src.ms2 import *
 from src.librarygeneration import *
 from src.common import *
+from src.swathsplit import *
+from src.swathwindows import get_swath_windows, verify_swath_windows
+from src.jobqueue import submit_openswath_job, get_queue_status
+from src.ingest import get_catalog
 
 st.set_page_config(layout="wide")
 st.session_state.mzML_options = [
@@ -19,6 +23,13 @@ st.session_state.mass_list_options = [
     p.name for p in Path("precursor-lists").glob("*.tsv")
 ]
 
+with st.sidebar.expander("mzML index"):
+    st.markdown("Files are indexed in the background by `python -m src.ingest`, indexed files open faster.")
+    st.dataframe(get_catalog(), hide_index=True)
+
+# results of this session, other users work in their own workspace
+results_dir = Path(get_session_workspace(), "results")
+
 st.title("OpenSWATH Metabolomics")
 t1, t2, t3, t4, t5 = st.tabs(
     [
@@ -56,40 +67,92 @@ with t1:
         options=st.session_state.window_options,
         key="openswath_windows",
     )
+    # header-only check of the acquired SWATH windows, cached next to each mzML file
+    for f in st.session_state.openswath_mzML if st.session_state.openswath_windows else []:
+        if get_swath_windows(str(Path("mzML-files", f)))[0].empty:
+            st.warning(f"No SWATH windows found in {f}, the window file is not verified.")
+        for problem in verify_swath_windows(str(Path("SWATH-windows", st.session_state.openswath_windows)),
+                                            str(Path("mzML-files", f))):
+            st.warning(problem)
+    with st.expander("SWATH windows from acquisition"):
+        st.markdown("Window files derived from the isolation windows of the selected mzML files.")
+        for f in st.session_state.openswath_mzML:
+            windows, _ = get_swath_windows(str(Path("mzML-files", f)))
+            c1, c2 = st.columns([3, 1])
+            c1.markdown(f"**{f}**: {len(windows)} windows from {windows['start'].min():g} to {windows['stop'].max():g} m/z"
+                        if not windows.empty else f"**{f}**: no SWATH windows found")
+            if c2.button("Save as window file", key=f"save-windows-{f}", disabled=windows.empty):
+                windows.to_csv(Path("SWATH-windows", Path(f).stem + ".tsv"), sep="\t", index=False)
+                st.rerun()
     _, c1, _ = st.columns(3)
     if c1.button(label="Run OpenSWATH Workflow", type="primary"):
-        run_openswath(
+        runs = run_openswath(
             [str(Path("mzML-files", f))
              for f in st.session_state.openswath_mzML],
             str(st.session_state.openswath_rt_window),
             str(Path("assay-libraries", st.session_state.openswath_library)),
             str(Path("SWATH-windows", st.session_state.openswath_windows)),
-            "results",
+            str(results_dir),
+            on_wait=lambda: st.info("Waiting for memory of other running jobs..."),
         )
+        for _, run in runs.iterrows():
+            if run["success"]:
+                st.success("OpenSWATH run was successful.")
+                if not run["identifications"]:
+                    st.warning("Results are empty, no metabolites detected. This run will not be shown in results.")
+            else:
+                st.error(
+                    "Something went wrong during OpenSWATH run, check your inputs and terminal output."
+                )
+    with st.expander("Worker queue"):
+        st.markdown("Submit the runs to a queue on a shared directory, they are processed by workers started with `python -m src.jobqueue -queue_directory <directory>` on any node with access to it.")
+        queue_dir = st.text_input("queue directory", "job-queue")
+        if st.button("Submit to worker queue", disabled=not st.session_state.openswath_mzML):
+            for f in st.session_state.openswath_mzML:
+                submit_openswath_job(
+                    queue_dir,
+                    str(Path("mzML-files", f)),
+                    str(Path("assay-libraries", st.session_state.openswath_library)),
+                    str(Path("SWATH-windows", st.session_state.openswath_windows)),
+                    str(st.session_state.openswath_rt_window),
+                    str(results_dir),
+                )
+            st.success(f"Submitted {len(st.session_state.openswath_mzML)} jobs.")
+        if Path(queue_dir).is_dir():
+            show_table(get_queue_status(queue_dir))
+    with st.expander("Split SWATH files into windows"):
+        st.markdown("Pre-split the selected mzML files once into one file per SWATH window. OpenSWATH, extracted ion chromatograms and MS2 spectra then read only the windows with library precursors.")
+        if st.button("Split files", disabled=not st.session_state.openswath_mzML):
+            for f in st.session_state.openswath_mzML:
+                with st.spinner(f"Splitting {f}..."):
+                    index = split_swath_file(str(Path("mzML-files", f)), str(Path("SWATH-windows", st.session_state.openswath_windows)))
+                st.success(f"Split {f} into {(index['window'] >= 0).sum()} SWATH windows.")
+                unassigned = index.loc[index["window"] == -2, "spectra"].sum()
+                if unassigned:
+                    st.warning(f"{unassigned} MS2 spectra of {f} are in no window of the window file and were not stored.")
 
 with t2:
-    if any(Path("results").glob("*.tsv")):
+    if any(results_dir.glob("*.tsv")):
         c1, c2 = st.columns(2)
         title = c1.text_input(label="custom plot title", value="")
 
         c1, c2 = st.columns(2)
-        df = pd.DataFrame({"filename": [f.name for f in Path("results").glob("*.tsv")]})
-        df["time changed"] = [Path("results", f).stat().st_mtime for f in df["filename"]]
+        df = pd.DataFrame({"filename": [f.name for f in results_dir.glob("*.tsv")]})
+        df["time changed"] = [Path(results_dir, f).stat().st_mtime for f in df["filename"]]
         df = df.sort_values("time changed", ascending=False)
         file1 = c1.selectbox("select result file", df["filename"])
         remaining = df["filename"].tolist()
         remaining.remove(file1)
         remaining.insert(0, "none")
         file2 = c2.selectbox("select result file for visual comparison", remaining)
-        files = [str(Path("results", file1))]
+        files = [str(Path(results_dir, file1))]
         if file2 != "none":
-            files.append(str(Path("results", file2)))
+            files.append(str(Path(results_dir, file2)))
 
         fig = plot_openswath_results(files, title)
         show_fig(fig, "openswath-results")
         st.markdown(file1)
-        df = pd.read_csv(Path("results", file1), sep="\t")
-        show_table(df, "openswath-results")
+        show_table_file(Path(results_dir, file1), "openswath-results")
     else:
         st.warning("No results to show.")
 
@@ -101,27 +164,58 @@ with t3:
     eic_noise = c1.number_input("noise threshhold", 0, 10000, 1000, 1000)
     eic_ppm = c2.number_input("tolerance (ppm)", 1, 50, 10, 1)
     eic_rt_window = c3.number_input("RT window", 1, 300, 5)
+    eic_targets = st.text_area("additional targets", "", placeholder="name, m/z, RT (one target per line)",
+                               help="Fast for files indexed in the background, which are queried from their MS1 peak index.")
+    try:
+        eic_targets = tuple((n.strip(), float(mz), float(rt)) for n, mz, rt in
+                            (line.split(",") for line in eic_targets.splitlines() if line.strip()))
+    except ValueError:
+        st.error("Invalid additional targets, use one 'name, m/z, RT' per line.")
+        eic_targets = ()
+
+    st.session_state.eic = None
 
-    if "eic_df" not in st.session_state:
-        st.session_state.eic_df = pd.DataFrame()
-    
     _, c2, _ = st.columns(3)
     if c2.button("Extract Ion Chromatograms", type="primary"):
-        st.session_state.eic_df = get_extracted_ion_chromatogram(str(Path("mzML-files", file)),
-                                            str(Path("assay-libraries", library)),
+        st.session_state.eic_extraction = (str(Path("mzML-files", file)), str(Path("assay-libraries", library)), eic_ppm, eic_targets)
+    if "eic_extraction" in st.session_state:
+        # raw traces are cached per file, library and ppm, noise and RT window are applied on every rerun
+        eic_file, eic_library, ppm, targets = st.session_state.eic_extraction
+        st.session_state.eic = get_extracted_ion_chromatogram(eic_file,
+                                            eic_library,
                                             eic_noise,
                                             eic_rt_window,
-                                            eic_ppm)
+                                            ppm,
+                                            extra_targets=targets)
 
-    if not st.session_state.eic_df.empty:
-        fig = px.bar(st.session_state.eic_df["area"])
+    if st.session_state.eic is not None and not st.session_state.eic.empty:
+        eic_df = st.session_state.eic.compounds
+        fig = px.bar(eic_df["area"])
         fig.update_layout(showlegend=False, xaxis_title="", yaxis_title="intensity")
         show_fig(fig, "eic-area-plot")
-        metabolite = st.selectbox("metabolite", st.session_state.eic_df["area"].sort_values(ascending=False).index)
-        fig = px.line(x=st.session_state.eic_df.loc[metabolite, "times"], y=st.session_state.eic_df.loc[metabolite, "intensities"])
+        metabolite = st.selectbox("metabolite", eic_df["area"].sort_values(ascending=False).index)
+        fig = px.line(x=st.session_state.eic.times, y=st.session_state.eic.trace(metabolite))
         fig.update_layout(showlegend=False, xaxis_title="retention time (s)", yaxis_title="counts per second (cps)", title=metabolite)
         show_fig(fig, metabolite)
-        show_table(st.session_state.eic_df[["mz", "RT", "area"]], "eic-areas")
+        show_table(eic_df[["mz", "RT", "apex RT", "apex intensity", "start RT", "end RT", "FWHM", "area"]], "eic-areas")
+
+    with st.expander("Batch extraction over multiple mzML files"):
+        batch_files = st.multiselect("mzML files", options=st.session_state.mzML_options, key="eic_batch_files")
+        if st.button("Extract Ion Chromatograms for all files", disabled=not batch_files):
+            bar = st.progress(0.0, "Extracting...")
+            st.session_state.eic_batch_areas, _ = get_eic_area_matrix(
+                [str(Path("mzML-files", f)) for f in batch_files],
+                str(Path("assay-libraries", library)),
+                eic_noise,
+                eic_rt_window,
+                eic_ppm,
+                progress=lambda i, n, f: bar.progress(i / n, f"Extracted {Path(f).name} ({i}/{n})"),
+            )
+        if "eic_batch_areas" in st.session_state:
+            fig = px.bar(st.session_state.eic_batch_areas, barmode="group")
+            fig.update_layout(xaxis_title="", yaxis_title="area", legend_title="sample")
+            show_fig(fig, "eic-batch-area-plot")
+            show_table(st.session_state.eic_batch_areas, "eic-batch-areas")
 
 with t4:
     df = pd.DataFrame()
@@ -130,8 +224,9 @@ with t4:
         options=st.session_state.mzML_options,
         key="ms2_file",
     )
+    ms2_precursor = st.number_input("only spectra from the SWATH window of precursor m/z (0 shows all)", 0.0, 2000.0, 0.0, key="ms2_precursor")
     if st.session_state.ms2_file:
-        df = get_ms2_df(str(Path("mzML-files", st.session_state.ms2_file)))
+        df = get_ms2_df(str(Path("mzML-files", st.session_state.ms2_file)), [ms2_precursor] if ms2_precursor else None)
     if not df.empty:
         st.selectbox(
             "select MS2 spectrum",
@@ -141,9 +236,22 @@ with t4:
             ],
             key="ms2_spec",
         )
-        fig = get_ms2_spec_plot(df, st.session_state.ms2_spec)
+        fig = get_ms2_spec_plot(df, st.session_state.ms2_spec, str(Path("mzML-files", st.session_state.ms2_file)))
         show_fig(fig, st.session_state.ms2_spec)
 
+        with st.expander("Library search"):
+            c1, c2 = st.columns(2)
+            ms2_library = c1.selectbox("assay library", options=st.session_state.library_options, key="ms2_library")
+            ms2_tolerance = c2.number_input("precursor tolerance (Da)", 0.001, 50.0, 0.05, format="%.3f",
+                                            help="Use half of the isolation window width for SWATH data.")
+            if st.checkbox("search all MS2 spectra of this file", key="ms2_search"):
+                hits = get_library_hits(str(Path("mzML-files", st.session_state.ms2_file)),
+                                        str(Path("assay-libraries", ms2_library)), ms2_tolerance)
+                spectrum = df.loc[int(st.session_state.ms2_spec.split(" ")[0])]
+                st.markdown("**Top hits for the selected spectrum**")
+                st.dataframe(get_spectrum_hits(hits, spectrum), hide_index=True, use_container_width=True)
+                show_table(hits[hits["rank"] == 1].sort_values("score", ascending=False), "library-hits")
+
     else:
         st.warning("No MS2 spectra in data!")
 
@@ -162,19 +270,37 @@ with t5:
     collision_energy = c1.number_input("collision energy", 10, 50, 10, 5)
     v_space(1, c2)
     exclude_precursor_mass = c2.checkbox("exclude precursor mass", True)
+    with st.expander("Multiple DDA files"):
+        additional_mzML_files = st.multiselect(
+            "additional mzML files with DDA data",
+            options=[f for f in st.session_state.mzML_options if f != mzML_file]
+        )
+        consensus = st.checkbox("merge spectra of all files into a consensus spectrum", True,
+                                help="Otherwise the spectrum with the highest TIC across all files is used.")
     _, c, _ = st.columns(3)
     df = pd.DataFrame()
     if c.button("Generate Library", type="primary"):
-        st.session_state.genlib_filename = f"{mzML_file[:-5]}_{precursor_file[:-4]}_top{top_n}_{exclude_precursor_mass}_ppm{tolerance_ppm}_ce{collision_energy}"
-        df = pd.read_csv(str(Path("precursor-lists", precursor_file)), sep="\t", names=["name", "mz", "sum formula"])
-        df = generate_library(
-                str(Path("precursor-lists", precursor_file)),
-                str(Path("mzML-files", mzML_file)),
-                top_n,
-                exclude_precursor_mass,
-                tolerance_ppm,
-                collision_energy
-        )
+        if additional_mzML_files:
+            st.session_state.genlib_filename = f"{mzML_file[:-5]}+{len(additional_mzML_files)}{'_consensus' if consensus else ''}_{precursor_file[:-4]}_top{top_n}_{exclude_precursor_mass}_ppm{tolerance_ppm}_ce{collision_energy}"
+            df = generate_library_from_files(
+                    str(Path("precursor-lists", precursor_file)),
+                    [str(Path("mzML-files", f)) for f in [mzML_file] + additional_mzML_files],
+                    top_n,
+                    exclude_precursor_mass,
+                    tolerance_ppm,
+                    collision_energy,
+                    consensus
+            )
+        else:
+            st.session_state.genlib_filename = f"{mzML_file[:-5]}_{precursor_file[:-4]}_top{top_n}_{exclude_precursor_mass}_ppm{tolerance_ppm}_ce{collision_energy}"
+            df = generate_library(
+                    str(Path("precursor-lists", precursor_file)),
+                    str(Path("mzML-files", mzML_file)),
+                    top_n,
+                    exclude_precursor_mass,
+                    tolerance_ppm,
+                    collision_energy
+            )
         df.to_csv(Path("assay-libraries", st.session_state.genlib_filename+".tsv"), sep="\t")
     if "genlib_filename" in st.session_state:
         df = pd.read_csv(Path("assay-libraries", st.session_state.genlib_filename+".tsv"), sep="\t")
@@ -0,0 +1 @@
+python -m src.cli %*
\ No newline at end of file
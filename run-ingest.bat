@@ -0,0 +1 @@
+python -m src.ingest -input_directory mzML-files
\ No newline at end of file
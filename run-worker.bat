@@ -0,0 +1 @@
+python -m src.jobqueue -queue_directory job-queue
\ No newline at end of file
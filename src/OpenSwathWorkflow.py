@@ -1,9 +1,9 @@
-import streamlit as st
 import argparse
 import subprocess
 import shutil
 from pathlib import Path
 import pandas as pd
+from workspace import create_job_directory, publish_file
 
 # Initialize parser
 parser = argparse.ArgumentParser()
@@ -54,14 +54,13 @@ mzML_files = args.input
 if args.input_directory:
     mzML_files = [str(path) for path in Path(args.input_directory).glob("*.mzML")]
 
-# override results directory
-out = Path(args.output_directory)
-if out.is_dir():
-    shutil.rmtree(out)
-out.mkdir()
+# results are written to a private job directory and moved into the output directory when complete,
+# existing results of other files and concurrent runs are left untouched
+Path(args.output_directory).mkdir(parents=True, exist_ok=True)
+job_dir = create_job_directory(args.output_directory)
 
 for file in mzML_files:
-    out = str(Path(args.output_directory, Path(file).stem + ".tsv"))
+    out = str(Path(job_dir, Path(file).stem + ".tsv"))
     # Set up command for OpenSwathWorkflow
     command = [
         "OpenSwathWorkflow",
@@ -78,7 +77,7 @@ for file in mzML_files:
         args.rt_extraction_window,
         # "--use_ms1_traces"
         "-out_chrom",
-        "results/chrom.mzML"
+        str(Path(job_dir, Path(file).stem + "_chrom.mzML")),
     ]
 
     print("Running command:", subprocess.list2cmdline(command))
@@ -87,10 +86,18 @@ for file in mzML_files:
 
     print(result.stdout)
 
-    df = pd.read_csv(out, sep="\t")
-    if df.empty:
-        st.warning(f"Empty output for {file} generated!")
+    if not Path(out).exists():
+        print(f"No output for {file} generated!")
+    elif pd.read_csv(out, sep="\t").empty:
+        print(f"Empty output for {file} generated!")
         Path(out).unlink()
+    else:
+        publish_file(out, Path(args.output_directory, Path(out).name))
+    chrom = Path(job_dir, Path(file).stem + "_chrom.mzML")
+    if chrom.exists():
+        publish_file(chrom, Path(args.output_directory, chrom.name))
+
+shutil.rmtree(job_dir, ignore_errors=True)
 
 
 # RT:
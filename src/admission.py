@@ -0,0 +1,318 @@
+import json
+import os
+import signal
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+import pandas as pd
+
+from .ingest import is_indexed, load_scan_headers
+
+try:
+    import fcntl
+    import resource
+except ImportError:
+    # not available on Windows, jobs then run without rlimits and usage records
+    fcntl = resource = None
+
+# Memory model per job kind: base MB + MB per MB of input data + MB per library row.
+# The per input factor is raised from recorded peak usage (see record_usage), it
+# never drops below the default.
+DEFAULT_MODELS = {
+    "openswath": {"base": 500, "per_input_mb": 2.0, "per_library_row": 0.01},
+    "eic": {"base": 300, "per_input_mb": 1.5, "per_library_row": 0.0},
+}
+HISTORY_FILE = Path("admission-history.tsv")
+# reservations of all processes on this host (Streamlit apps, CLI, queue workers)
+LEDGER_FILE = Path(tempfile.gettempdir(), "swath-admission-ledger.json")
+# output of a job which failed to allocate memory (C++ and Python)
+_MEMORY_ERRORS = ("std::bad_alloc", "MemoryError", "Cannot allocate memory")
+_history_lock = threading.Lock()
+
+
+def get_total_memory_mb():
+    """
+    Memory available to jobs, from OPENSWATH_MEMORY_LIMIT_MB or 80% of the physical memory.
+
+    Returns:
+        float: Memory budget in MB.
+    """
+    if os.environ.get("OPENSWATH_MEMORY_LIMIT_MB"):
+        return float(os.environ["OPENSWATH_MEMORY_LIMIT_MB"])
+    try:
+        return 0.8 * os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1e6
+    except (AttributeError, ValueError, OSError):
+        return 8000.0
+
+
+def record_usage(kind, input_mb, library_rows, peak_mb, basis="file", history_file=HISTORY_FILE):
+    """
+    Append the measured peak memory of a finished job to the usage history.
+
+    Args:
+        kind (str): Job kind, one of DEFAULT_MODELS.
+        input_mb (float): Size of the input file in MB.
+        library_rows (int): Number of library rows.
+        peak_mb (float): Measured peak resident memory in MB.
+        basis (str): How input_mb was measured, "peaks" (decoded size) or "file" (file size).
+        history_file (Path): Usage history (tsv).
+
+    Returns:
+        None
+    """
+    # threads of this process and other processes (queue workers) append concurrently
+    with _history_lock, open(history_file, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        if f.tell() == 0:
+            f.write("kind\tbasis\tinput_mb\tlibrary_rows\tpeak_mb\n")
+        f.write(f"{kind}\t{basis}\t{input_mb:.1f}\t{library_rows}\t{peak_mb:.1f}\n")
+
+
+def estimate_resources(kind, input_file, library="", threads=1, history_file=HISTORY_FILE):
+    """
+    Estimate memory and CPU needs of a job from its input sizes.
+
+    For indexed mzML files (see ingest.py) the input size is the decoded size of
+    all peaks from the scan headers, otherwise the file size. With at least three
+    recorded jobs of the same kind and size basis the MB per input MB factor is
+    raised to the 90th percentile of the recorded ratios (with 20% headroom).
+
+    Args:
+        kind (str): Job kind, one of DEFAULT_MODELS.
+        input_file (str): Input mzML (or sqMass) file.
+        library (str): Assay library (tsv), optional.
+        threads (int): Number of threads the job will use.
+        history_file (Path): Usage history (tsv).
+
+    Returns:
+        dict: "memory_mb", "cpus", "input_mb", "basis" ("peaks" or "file") and "library_rows".
+    """
+    model = dict(DEFAULT_MODELS[kind])
+    if is_indexed(input_file):
+        # m/z and intensity as 8 byte values, compression does not distort the estimate
+        input_mb = load_scan_headers(input_file)["peaks"].sum() * 16 / 1e6
+        basis = "peaks"
+    else:
+        input_mb = Path(input_file).stat().st_size / 1e6
+        basis = "file"
+    library_rows = 0
+    if library:
+        with open(library) as f:
+            library_rows = max(0, sum(1 for _ in f) - 1)
+
+    if Path(history_file).exists():
+        history = pd.read_csv(history_file, sep="\t")
+        history = history[(history["kind"] == kind) & (history["basis"] == basis) & (history["input_mb"] > 0)]
+        if len(history) >= 3:
+            ratios = (history["peak_mb"] - model["base"] - model["per_library_row"] * history["library_rows"]) / history["input_mb"]
+            model["per_input_mb"] = max(model["per_input_mb"], 1.2 * ratios.quantile(0.9))
+
+    memory_mb = model["base"] + model["per_input_mb"] * input_mb + model["per_library_row"] * library_rows
+    return {"memory_mb": memory_mb, "cpus": threads, "input_mb": input_mb, "basis": basis, "library_rows": library_rows}
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class HostLedger:
+    """
+    Memory and CPU reservations of all processes on this host in a locked json file.
+
+    Reservations of processes which no longer exist are dropped. Without fcntl
+    (Windows) nothing is recorded and every reservation succeeds.
+    """
+
+    def __init__(self, path=LEDGER_FILE):
+        self.path = Path(path)
+
+    @contextmanager
+    def _locked(self):
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                reservations = json.loads(f.read() or "{}")
+            except ValueError:
+                reservations = {}
+            reservations = {k: r for k, r in reservations.items() if _is_alive(r["pid"])}
+            yield reservations
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(reservations))
+
+    def try_reserve(self, key, memory_mb, cpus, memory_budget, cpu_budget):
+        """Reserve if the reservations of all processes fit the budget (or there are none)."""
+        if fcntl is None:
+            return True
+        try:
+            with self._locked() as reservations:
+                used_memory = sum(r["memory_mb"] for r in reservations.values())
+                used_cpus = sum(r["cpus"] for r in reservations.values())
+                if reservations and (used_memory + memory_mb > memory_budget or used_cpus + cpus > cpu_budget):
+                    return False
+                reservations[key] = {"pid": os.getpid(), "memory_mb": memory_mb, "cpus": cpus}
+                return True
+        except OSError:
+            # e.g. the ledger belongs to another user, fall back to the budget of this process
+            return True
+
+    def release(self, key):
+        if fcntl is None:
+            return
+        try:
+            with self._locked() as reservations:
+                reservations.pop(key, None)
+        except OSError:
+            pass
+
+
+class AdmissionController:
+    """
+    Admits jobs in arrival order as long as their estimated memory and CPUs fit the budget.
+
+    A job larger than the whole budget is admitted alone. The budget is shared
+    with the other processes on this host through a HostLedger, jobs waiting for
+    another process poll it every poll_seconds.
+    """
+
+    def __init__(self, memory_mb=None, cpus=None, ledger_file=LEDGER_FILE, poll_seconds=1.0):
+        self.memory_mb = memory_mb or get_total_memory_mb()
+        self.cpus = cpus or os.cpu_count() or 1
+        self.used_memory_mb = 0.0
+        self.used_cpus = 0
+        self.running = 0
+        self._queue = []
+        self._condition = threading.Condition()
+        self._ledger = HostLedger(ledger_file)
+        self._poll_seconds = poll_seconds
+
+    def _fits(self, memory_mb, cpus):
+        if self.running == 0:
+            return True
+        return self.used_memory_mb + memory_mb <= self.memory_mb and self.used_cpus + cpus <= self.cpus
+
+    @contextmanager
+    def admit(self, estimate, on_wait=None):
+        """
+        Block until the job fits, reserve its resources while the context is active.
+
+        Args:
+            estimate (dict): Resource estimate (see estimate_resources).
+            on_wait (callable, optional): Called once if the job has to wait.
+        """
+        memory_mb, cpus = estimate["memory_mb"], estimate["cpus"]
+        ticket = object()
+        key = f"{os.getpid()}-{id(ticket)}"
+        with self._condition:
+            self._queue.append(ticket)
+            waited = False
+            try:
+                while self._queue[0] is not ticket or not self._fits(memory_mb, cpus) or \
+                        not self._ledger.try_reserve(key, memory_mb, cpus, self.memory_mb, self.cpus):
+                    if on_wait and not waited:
+                        on_wait()
+                    waited = True
+                    # other processes release without notifying, poll the ledger
+                    self._condition.wait(self._poll_seconds)
+            except BaseException:
+                # an aborted waiter (e.g. a Streamlit rerun in on_wait) must not block the queue
+                self._queue.remove(ticket)
+                self._condition.notify_all()
+                raise
+            self._queue.pop(0)
+            self.used_memory_mb += memory_mb
+            self.used_cpus += cpus
+            self.running += 1
+            self._condition.notify_all()
+        try:
+            yield
+        finally:
+            self._ledger.release(key)
+            with self._condition:
+                self.used_memory_mb -= memory_mb
+                self.used_cpus -= cpus
+                self.running -= 1
+                self._condition.notify_all()
+
+    def max_parallel(self, estimate):
+        """Number of jobs with this estimate that fit the budget at once."""
+        return max(1, min(self.cpus // max(1, estimate["cpus"]), int(self.memory_mb // max(1, estimate["memory_mb"]))))
+
+
+# one controller per process, shared by all sessions of the Streamlit server,
+# processes on the same host share the budget through LEDGER_FILE
+controller = AdmissionController()
+
+
+def _run_limited(command, limit_mb, on_start=None):
+    # returns (returncode, output, peak MB, hit the memory limit)
+    with tempfile.TemporaryFile("w+") as output:
+        process = subprocess.Popen(command, stdout=output, stderr=subprocess.STDOUT, text=True)
+        # set from the parent, preexec_fn is not safe in threaded processes (Linux only)
+        limited = False
+        if hasattr(resource, "prlimit"):
+            limit = int(limit_mb * 1e6)
+            try:
+                resource.prlimit(process.pid, resource.RLIMIT_DATA, (limit, limit))
+                limited = True
+            except (ProcessLookupError, PermissionError):
+                pass
+        if on_start:
+            on_start(process)
+        # wait4 reports the resource usage of this child only (ru_maxrss is in KB on Linux)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        output.seek(0)
+        stdout = output.read()
+    capped = limited and process.returncode != 0 and (
+        process.returncode in (-signal.SIGABRT, -signal.SIGSEGV) or any(e in stdout for e in _MEMORY_ERRORS))
+    return process.returncode, stdout, usage.ru_maxrss / 1000, capped
+
+
+def run_admitted(command, estimate, kind, on_wait=None, memory_cap_factor=2.0, on_start=None, retry=True):
+    """
+    Run a command once admitted, with a memory rlimit, and record its peak memory.
+
+    The rlimit is memory_cap_factor times the estimate (at least 1 GB), so a
+    runaway job fails instead of taking down the host. A job which fails to
+    allocate memory under the rlimit is run once more, admitted with its
+    previous limit as estimate.
+
+    Args:
+        command (list): The command.
+        estimate (dict): Resource estimate (see estimate_resources).
+        kind (str): Job kind for the usage history.
+        on_wait (callable, optional): Called once if the job has to wait.
+        memory_cap_factor (float): rlimit as multiple of the estimated memory.
+        on_start (callable, optional): Called with the subprocess.Popen once started, e.g. to kill it.
+        retry (bool): Run once more with a higher limit if the job hit its memory limit.
+
+    Returns:
+        subprocess.CompletedProcess: The finished process (stdout and stderr combined in stdout).
+    """
+    with controller.admit(estimate, on_wait):
+        if resource is None:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            if on_start:
+                on_start(process)
+            stdout, stderr = process.communicate()
+            return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+        limit_mb = max(1000, memory_cap_factor * estimate["memory_mb"])
+        returncode, stdout, peak_mb, capped = _run_limited(command, limit_mb, on_start)
+    if returncode == 0:
+        record_usage(kind, estimate["input_mb"], estimate["library_rows"], peak_mb, estimate["basis"])
+    elif capped and retry:
+        # the estimate was too low, successful retries raise it for later jobs
+        return run_admitted(command, dict(estimate, memory_mb=limit_mb), kind, on_wait, memory_cap_factor,
+                            on_start, retry=False)
+    return subprocess.CompletedProcess(command, returncode, stdout, "")
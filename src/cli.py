@@ -0,0 +1,232 @@
+import argparse
+import json
+import sys
+import uuid
+from pathlib import Path
+
+# Batch command line interface for headless nodes, e.g.
+#   python -m src.cli eic -input_directory mzML-files -library assay-libraries/lib.tsv -out areas.parquet
+# Only argparse is imported on start-up, the compute modules (pandas, pyopenms)
+# are imported by the sub-command that needs them. Output tables are written as
+# tsv, json (records) or parquet depending on the file extension, a json
+# summary of each command is printed to stdout.
+
+
+def _get_input_files(args):
+    files = list(args.input)
+    if args.input_directory:
+        files += sorted(str(path) for path in Path(args.input_directory).glob("*.mzML"))
+    if not files:
+        sys.exit("No input files, use -input or -input_directory.")
+    return files
+
+
+def _write_table(df, path, index=True):
+    """
+    Write a table as tsv, json or parquet (from the file extension), replacing the file atomically.
+
+    Args:
+        df (pd.DataFrame): The table.
+        path (str): Output file (.tsv, .json or .parquet).
+        index (bool): Write the index as first column.
+
+    Returns:
+        None
+    """
+    from .workspace import publish_file
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+    if path.suffix == ".json":
+        (df.reset_index() if index else df).to_json(tmp, orient="records", indent=1)
+    elif path.suffix == ".parquet":
+        try:
+            df.to_parquet(tmp, index=index)
+        except ImportError:
+            sys.exit("Parquet output requires pyarrow (pip install pyarrow), use a .tsv or .json file instead.")
+    else:
+        df.to_csv(tmp, sep="\t", index=index)
+    publish_file(tmp, path)
+
+
+def _print_summary(**summary):
+    print(json.dumps(summary, indent=1, default=str))
+
+
+def run_openswath_command(args):
+    from .runopenswath import run_openswath
+    from .swathwindows import get_swath_windows, verify_swath_windows
+
+    files = _get_input_files(args)
+    for file in files:
+        if get_swath_windows(file)[0].empty:
+            print(f"No SWATH windows found in {Path(file).name}, the window file is not verified.", file=sys.stderr)
+    problems = [p for f in files for p in verify_swath_windows(args.swath_windows_file, f)]
+    if problems:
+        sys.exit("\n".join(["SWATH window file does not match the data:"] + problems))
+    runs = run_openswath(files, args.rt_extraction_window, args.library,
+                         args.swath_windows_file, args.output_directory, args.threads)
+    if args.summary:
+        _write_table(runs, args.summary, index=False)
+    _print_summary(command="openswath", files=len(runs), successful=int(runs["success"].sum()),
+                   output_directory=args.output_directory)
+    return 0 if runs["success"].all() else 1
+
+
+def run_windows_command(args):
+    from .swathwindows import get_swath_windows, verify_swath_windows
+
+    files = _get_input_files(args)
+    windows = {}
+    for file in files:
+        acquired, path = get_swath_windows(file)
+        windows[file] = {"windows": len(acquired), "window file": path}
+        if args.swath_windows_file:
+            windows[file]["problems"] = verify_swath_windows(args.swath_windows_file, file)
+    _print_summary(command="windows", files=windows)
+    return 1 if any(w.get("problems") or not w["windows"] for w in windows.values()) else 0
+
+
+def run_eic_command(args):
+    from .eic import get_eic_area_matrix
+
+    files = _get_input_files(args)
+    areas, traces = get_eic_area_matrix(
+        files, args.library, args.noise, args.rt_window, args.tolerance_ppm, args.threads or None,
+        progress=lambda i, n, f: print(f"Extracted {Path(f).name} ({i}/{n})", file=sys.stderr),
+    )
+    _write_table(areas, args.out)
+    if args.traces_directory:
+        for name, eic in traces.items():
+            eic.save(Path(args.traces_directory, f"{name}_eic"))
+    _print_summary(command="eic", files=len(files), compounds=len(areas), out=args.out)
+    return 0
+
+
+def run_library_command(args):
+    from .librarygeneration import generate_library, generate_library_from_files
+
+    files = _get_input_files(args)
+    if len(files) == 1:
+        df = generate_library(args.precursor_list, files[0], args.top_n, not args.keep_precursor_mass,
+                              args.tolerance_ppm, args.collision_energy)
+    else:
+        df = generate_library_from_files(args.precursor_list, files, args.top_n, not args.keep_precursor_mass,
+                                         args.tolerance_ppm, args.collision_energy, not args.best_spectrum,
+                                         args.threads or None)
+    _write_table(df, args.out, index=False)
+    _print_summary(command="library", files=len(files), transitions=len(df),
+                   compounds=df["CompoundName"].nunique() if not df.empty else 0, out=args.out)
+    return 0
+
+
+def run_dedup_command(args):
+    import pandas as pd
+    from .librarygeneration import filter_duplicate_transitions
+
+    df = pd.read_csv(args.library, sep="\t").reset_index(drop=True)
+    filtered = filter_duplicate_transitions(df, args.threshold_ppm)
+    _write_table(filtered, args.out, index=False)
+    _print_summary(command="dedup", transitions=len(df), removed=len(df) - len(filtered), out=args.out)
+    return 0
+
+
+def run_validate_command(args):
+    from .validation import build_validation_summary
+
+    eic_areas = None
+    if args.mzML or args.mzML_directory:
+        from .eic import get_eic_area_matrix
+
+        files = list(args.mzML)
+        if args.mzML_directory:
+            files += sorted(str(path) for path in Path(args.mzML_directory).glob("*.mzML"))
+        eic_areas, _ = get_eic_area_matrix(files, args.library, args.noise, args.rt_window, args.tolerance_ppm,
+                                           args.threads or None)
+    tsvs = list(args.input)
+    if args.input_directory:
+        tsvs += sorted(str(path) for path in Path(args.input_directory).glob("*.tsv"))
+    df = build_validation_summary(tsvs, eic_areas)
+    _write_table(df, args.out)
+    _print_summary(command="validate", openswath_results=len(tsvs), compounds=len(df), out=args.out)
+    return 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Batch processing of SWATH metabolomics data without the web app.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_input(command, help="Input mzML files."):
+        command.add_argument("-input", help=help, nargs="+", default=[])
+        command.add_argument("-input_directory", help="Process all mzML files in this directory.", default="")
+
+    def add_eic_options(command):
+        command.add_argument("-noise", help="Intensities below this value are set to zero.", type=float, default=1000)
+        command.add_argument("-rt_window", help="RT window in seconds around the library RT.", type=float, default=5)
+        command.add_argument("-tolerance_ppm", help="Mass tolerance in ppm.", type=float, default=10)
+
+    command = commands.add_parser("openswath", help="Run OpenSwathWorkflow on mzML files.")
+    add_input(command)
+    command.add_argument("-library", help="Transition library.", required=True)
+    command.add_argument("-swath_windows_file", help="SWATH windows in tsv format (columns: start mz, stop mz).", required=True)
+    command.add_argument("-rt_extraction_window", help="RT extraction window in seconds.", default="10.0")
+    command.add_argument("-output_directory", help="Output directory for the result tsv files.", default="results")
+    command.add_argument("-threads", help="OpenSwathWorkflow threads per run.", type=int, default=1)
+    command.add_argument("-summary", help="Optional table with one row per run (tsv, json or parquet).", default="")
+    command.set_defaults(run=run_openswath_command)
+
+    command = commands.add_parser("windows", help="Derive the SWATH windows of mzML files from their spectrum headers.")
+    add_input(command)
+    command.add_argument("-swath_windows_file", help="Optionally verify this window file against each mzML file.", default="")
+    command.set_defaults(run=run_windows_command)
+
+    command = commands.add_parser("eic", help="Extract ion chromatograms and peak areas for library compounds.")
+    add_input(command)
+    command.add_argument("-library", help="Assay library (tsv).", required=True)
+    add_eic_options(command)
+    command.add_argument("-out", help="Area table, compounds x samples (tsv, json or parquet).", default="eic-areas.tsv")
+    command.add_argument("-traces_directory", help="Optionally store the chromatograms of each file here.", default="")
+    command.add_argument("-threads", help="Number of worker processes (default: fit the memory budget).", type=int, default=0)
+    command.set_defaults(run=run_eic_command)
+
+    command = commands.add_parser("library", help="Generate an assay library from DDA files.")
+    add_input(command, "Input mzML files with DDA data.")
+    command.add_argument("-precursor_list", help="Precursor list (tsv: name, m/z, sum formula).", required=True)
+    command.add_argument("-top_n", help="Number of MS2 peaks taken as transitions.", type=int, default=4)
+    command.add_argument("-keep_precursor_mass", help="Allow the precursor mass as transition.", action="store_true")
+    command.add_argument("-tolerance_ppm", help="Mass tolerance in ppm.", type=float, default=10)
+    command.add_argument("-collision_energy", help="Collision energy.", type=int, default=10)
+    command.add_argument("-best_spectrum", help="With multiple files use the spectrum with the highest TIC instead of a consensus spectrum.", action="store_true")
+    command.add_argument("-threads", help="Number of worker processes.", type=int, default=0)
+    command.add_argument("-out", help="Library file (tsv, json or parquet).", required=True)
+    command.set_defaults(run=run_library_command)
+
+    command = commands.add_parser("dedup", help="Remove transitions which are not unique in an assay library.")
+    command.add_argument("-library", help="Assay library (tsv).", required=True)
+    command.add_argument("-threshold_ppm", help="Transitions closer than this in precursor and product m/z are duplicates.", type=float, default=50)
+    command.add_argument("-out", help="Filtered library (tsv, json or parquet).", required=True)
+    command.set_defaults(run=run_dedup_command)
+
+    command = commands.add_parser("validate", help="Summarize OpenSWATH results and EIC areas per compound and sample.")
+    command.add_argument("-input", help="OpenSwathWorkflow result files (tsv).", nargs="+", default=[])
+    command.add_argument("-input_directory", help="Use all tsv files in this directory.", default="")
+    command.add_argument("-mzML", help="Optionally add EIC areas of these mzML files.", nargs="+", default=[])
+    command.add_argument("-mzML_directory", help="Optionally add EIC areas of all mzML files in this directory.", default="")
+    command.add_argument("-library", help="Assay library (tsv), required for EIC areas.", default="")
+    add_eic_options(command)
+    command.add_argument("-threads", help="Number of EIC worker processes.", type=int, default=0)
+    command.add_argument("-out", help="Summary table (tsv, json or parquet).", default="summary.tsv")
+    command.set_defaults(run=run_validate_command)
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    if args.command == "validate" and (args.mzML or args.mzML_directory) and not args.library:
+        sys.exit("-library is required for EIC areas.")
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,9 @@
 import streamlit as st
 import pandas as pd
 import shutil
+import re
+import uuid
+import operator
 from pathlib import Path
 
 def v_space(n: int, col=None) -> None:
@@ -21,30 +24,146 @@ def v_space(n: int, col=None) -> None:
             st.write("#")
 
 
-def show_table(df: pd.DataFrame, download_name: str = "") -> None:
+def _show_page(df: pd.DataFrame, key: str, page_size: int) -> pd.DataFrame:
+    """
+    Select the page of a dataframe to display, with page controls for large tables.
+
+    Args:
+        df (pd.DataFrame): The full (filtered) dataframe.
+        key (str): Unique key for the page widget.
+        page_size (int): Number of rows per page.
+
+    Returns:
+        pd.DataFrame: The rows of the selected page.
+    """
+    n_pages = max(1, -(-len(df) // page_size))
+    if n_pages == 1:
+        return df
+    c1, c2 = st.columns([1, 3])
+    page = c1.number_input(f"page (of {n_pages})", 1, n_pages, 1, key=f"{key}-page")
+    c2.caption(f"{len(df)} rows, showing {(page - 1) * page_size + 1} to {min(page * page_size, len(df))}")
+    return df.iloc[(page - 1) * page_size:page * page_size]
+
+
+def _lazy_download(get_data, download_name: str, key: str) -> None:
+    """
+    Download button which only serializes the data after the user asked for it.
+
+    Args:
+        get_data (callable): Returns the file content as bytes (or a binary file object).
+        download_name (str): The name to give to the downloaded file (without extension).
+        key (str): Unique key for the buttons.
+
+    Returns:
+        None
+    """
+    flag = f"{key}-download-requested"
+    if not st.session_state.get(flag, False):
+        if st.button("Download Table", key=f"{key}-prepare"):
+            st.session_state[flag] = True
+            st.rerun()
+        return
+    st.download_button(
+        "Save Table",
+        get_data(),
+        download_name.replace(" ", "-") + ".tsv",
+        key=f"{key}-download",
+        on_click=lambda: st.session_state.pop(flag, None),
+    )
+
+
+def show_table(df: pd.DataFrame, download_name: str = "", page_size: int = 1000) -> None:
     """
     Displays a pandas dataframe using Streamlit's `dataframe` function and
     provides a download button for the same table.
 
+    Large tables are shown page by page and the download is only generated
+    when requested.
+
     Args:
         df (pd.DataFrame): The pandas dataframe to display.
         download_name (str): The name to give to the downloaded file. Defaults to empty string.
+        page_size (int): Number of rows shown per page. Defaults to 1000.
 
     Returns:
         df (pd.DataFrame): The possibly edited dataframe.
     """
-    # Show dataframe using container width
-    st.dataframe(df, use_container_width=True)
+    key = download_name or "table"
+    # Show the selected page using container width
+    st.dataframe(_show_page(df, key, page_size), use_container_width=True)
     # Show download button with the given download name for the table if name is given
     if download_name:
-        st.download_button(
-            "Download Table",
-            df.to_csv(sep="\t").encode("utf-8"),
-            download_name.replace(" ", "-") + ".tsv",
-        )
+        _lazy_download(lambda: df.to_csv(sep="\t").encode("utf-8"), download_name, key)
     return df
 
 
+_FILTER_OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "contains": lambda values, value: values.astype(str).str.contains(value, regex=False),
+}
+
+
+def _filter_mask(chunk: pd.DataFrame, column: str, op: str, value: str) -> pd.Series:
+    # numeric columns are compared with the value as number, all others as text
+    values = chunk[column]
+    if op != "contains" and pd.api.types.is_numeric_dtype(values):
+        return _FILTER_OPERATORS[op](values, float(value))
+    return _FILTER_OPERATORS[op](values.astype(str), value)
+
+
+@st.cache_data(max_entries=4)
+def _read_table_file(path: str, mtime: float, columns: tuple, row_filter: tuple) -> pd.DataFrame:
+    # read in chunks, filtering and column selection are applied before chunks are combined
+    usecols = list(dict.fromkeys(columns + row_filter[:1])) if columns else None
+    chunks = []
+    for chunk in pd.read_csv(path, sep="\t", usecols=usecols, chunksize=100000):
+        if row_filter:
+            chunk = chunk[_filter_mask(chunk, *row_filter)]
+        chunks.append(chunk[list(columns)] if columns else chunk)
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=list(columns))
+
+
+def show_table_file(path: Path, download_name: str = "", page_size: int = 1000) -> None:
+    """
+    Displays a tsv file page by page, with column selection and a row filter
+    (column, operator, value) applied while reading the file.
+
+    Args:
+        path (Path): Path to the tsv file.
+        download_name (str): The name to give to the downloaded file. Defaults to empty string.
+        page_size (int): Number of rows shown per page. Defaults to 1000.
+
+    Returns:
+        None
+    """
+    key = download_name or Path(path).name
+    all_columns = pd.read_csv(path, sep="\t", nrows=0).columns.tolist()
+    c1, c2, c3, c4 = st.columns([4, 2, 1, 2])
+    columns = c1.multiselect("columns", all_columns, key=f"{key}-columns", placeholder="all columns")
+    filter_column = c2.selectbox("filter column", [""] + all_columns, key=f"{key}-filter-column",
+                                 format_func=lambda c: c or "no filter")
+    op = c3.selectbox("operator", list(_FILTER_OPERATORS), key=f"{key}-filter-operator")
+    value = c4.text_input("value", "", key=f"{key}-filter-value", placeholder="e.g. 1000")
+    row_filter = (filter_column, op, value) if filter_column and value else ()
+    try:
+        df = _read_table_file(str(path), Path(path).stat().st_mtime, tuple(columns), row_filter)
+    except ValueError as e:
+        st.error(f"Invalid filter: {e}")
+        return
+    st.dataframe(_show_page(df, key, page_size), use_container_width=True)
+    if download_name:
+        if columns or row_filter:
+            _lazy_download(lambda: df.to_csv(sep="\t", index=False).encode("utf-8"), download_name, key)
+        else:
+            # unfiltered: hand out the file itself without serializing the table
+            _lazy_download(lambda: Path(path).read_bytes(), download_name, key)
+
+
 def show_fig(fig, download_name: str, container_width: bool = True) -> None:
     """
     Displays a Plotly chart and adds a download button to the plot.
@@ -94,4 +213,28 @@ def reset_directory(path: Path) -> None:
     path = Path(path)
     if path.exists():
         shutil.rmtree(path)
-    path.mkdir(parents=True, exist_ok=True)
\ No newline at end of file
+    path.mkdir(parents=True, exist_ok=True)
+
+
+def get_session_workspace(root: Path = Path("workspaces")) -> Path:
+    """
+    Workspace directory of the current user session.
+
+    The workspace id is kept in the URL (?workspace=...), reloading the page or
+    sharing the link opens the same workspace.
+
+    Args:
+        root (Path): Directory containing all workspaces.
+
+    Returns:
+        Path: The workspace directory.
+    """
+    if "workspace" not in st.session_state:
+        workspace = st.query_params.get("workspace", "")
+        # only accept ids created here, never arbitrary paths
+        if not re.fullmatch("[0-9a-f]{32}", workspace):
+            workspace = uuid.uuid4().hex
+        st.query_params["workspace"] = workspace
+        st.session_state.workspace = Path(root, workspace)
+    st.session_state.workspace.mkdir(parents=True, exist_ok=True)
+    return st.session_state.workspace
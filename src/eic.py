@@ -1,52 +1,277 @@
-import streamlit as st
 import pandas as pd
 import numpy as np
+from pathlib import Path
+from dataclasses import dataclass
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pyopenms import *
+from .peakpicking import integrate_peaks
+from .swathsplit import load_split_experiment
+from .ingest import load_ms1_index, ms1_index_from_experiment
+from .admission import controller, estimate_resources
 
-@st.cache_data
-def get_extracted_ion_chromatogram(file, library, noise, rt_window, tolerance_ppm, openswath_metabolites=[]):
-    # load compound names, mz and RT values from library
+
+@dataclass
+class EICResult:
+    """
+    Extracted ion chromatograms of many compounds sharing one retention time axis.
+
+    Attributes:
+        compounds (pd.DataFrame): One row per compound (index "name") with "mz", "RT" and peak features.
+        times (np.ndarray): Retention times of the MS1 scans, shared by all compounds.
+        intensities (np.ndarray): float32 matrix (compounds x scans), rows in the order of compounds.
+    """
+    compounds: pd.DataFrame
+    times: np.ndarray
+    intensities: np.ndarray
+
+    @property
+    def empty(self):
+        return self.compounds.empty
+
+    def trace(self, name):
+        """Intensities of the first compound with the given name."""
+        return self.intensities[np.flatnonzero(self.compounds.index == name)[0]]
+
+    def save(self, path):
+        """
+        Store as directory with times.npy, intensities.npy and compounds.tsv.
+
+        The arrays are plain .npy files which load() memory maps without copying.
+        """
+        Path(path).mkdir(parents=True, exist_ok=True)
+        np.save(Path(path, "times.npy"), self.times)
+        np.save(Path(path, "intensities.npy"), np.ascontiguousarray(self.intensities, dtype=np.float32))
+        self.compounds.to_csv(Path(path, "compounds.tsv"), sep="\t")
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        mode = "r" if mmap else None
+        return cls(
+            pd.read_csv(Path(path, "compounds.tsv"), sep="\t", index_col="name"),
+            np.load(Path(path, "times.npy"), mmap_mode=mode),
+            np.load(Path(path, "intensities.npy"), mmap_mode=mode),
+        )
+
+
+def load_library_targets(library, openswath_metabolites=[]):
+    """
+    Load compound names, precursor m/z and retention times from an assay library.
+
+    Args:
+        library (str): Path to the assay library (tsv).
+        openswath_metabolites (list): Optionally restrict to these compound names.
+
+    Returns:
+        pd.DataFrame: One row per compound with "PrecursorMz" and "NormalizedRetentionTime".
+    """
     lib = pd.read_csv(library, sep="\t").groupby("CompoundName").mean("PrecursorMz")[["PrecursorMz", "NormalizedRetentionTime"]]
     lib.index = pd.Index([x.replace(",", "") for x in lib.index])
 
     if openswath_metabolites:
         lib = lib[lib.index.isin(openswath_metabolites)]
-    # load mzML file into exp
-    exp = MSExperiment()
-    MzMLFile().load(str(file), exp)
-
-    def extract_intensities(row):
-        intys = []
-        for spec in exp:
-            if spec.getMSLevel() == 2:
-                continue
-            if spec.getRT() < row["NormalizedRetentionTime"] - rt_window/2 or spec.getRT() > row["NormalizedRetentionTime"] + rt_window/2:
-                peak_intensity = 0
-            else:
-                delta = float((tolerance_ppm / 1000000) * row["PrecursorMz"])
-                index_highest_peak_within_window = spec.findHighestInWindow(
-                    row["PrecursorMz"], delta, delta)
-                # get peak intensity at highest peak index if above noise
-                peak_intensity = 0
-                if index_highest_peak_within_window > -1:
-                    peak_intensity = int(
-                        spec[index_highest_peak_within_window].getIntensity())
-                    if peak_intensity < noise:
-                        peak_intensity = 0
-            intys.append(peak_intensity)
-        return np.array(intys)
-    
-    times = []
-    for spec in exp:
-        if spec.getMSLevel() == 1:
-            times.append(spec.getRT())
-    
-    lib["intensities"] = lib.apply(extract_intensities, axis=1)
-    lib["times"] = [np.array(times) for _ in range(lib.shape[0])]
-    lib["area"] = lib["intensities"].apply(lambda x: int(np.trapz(x)))
+    return lib
+
+
+def query_ms1_index(index, mzs, tolerance_ppm):
+    """
+    Extract raw ion chromatograms for many targets from an MS1 peak index.
+
+    Per MS1 scan the highest peak within the ppm window (as findHighestInWindow),
+    each target needs two binary searches and a scatter-max into the scan axis.
+
+    Args:
+        index (dict): MS1 peak index (see src.ingest.ms1_index_from_experiment).
+        mzs (np.ndarray): Target m/z values.
+        tolerance_ppm (float): Mass tolerance in parts per million.
+
+    Returns:
+        np.ndarray: Intensity matrix (targets x MS1 scans).
+    """
+    mzs = np.asarray(mzs, dtype=float)
+    deltas = (tolerance_ppm / 1000000) * mzs
+    starts = np.searchsorted(index["mz"], mzs - deltas, side="left")
+    ends = np.searchsorted(index["mz"], mzs + deltas, side="right")
+    intensities = np.zeros((mzs.size, len(index["rt"])), dtype=np.float32)
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        np.maximum.at(intensities[i], index["scan"][start:end], index["intensity"][start:end])
+    # integer intensities as in the former spectrum based extraction
+    return np.trunc(intensities)
+
+
+def filter_traces(times, intensities, rts, noise, rt_window):
+    """
+    Apply noise threshold and RT window to raw ion chromatograms.
+
+    Args:
+        times (np.ndarray): Retention times of the MS1 scans.
+        intensities (np.ndarray): Raw intensity matrix (targets x MS1 scans).
+        rts (np.ndarray): Target retention times in seconds.
+        noise (int): Intensities below this value are set to zero.
+        rt_window (float): RT window in seconds around the target RT.
+
+    Returns:
+        np.ndarray: Filtered copy of the intensity matrix.
+    """
+    rts = np.asarray(rts, dtype=float)
+    outside = (times < rts[:, None] - rt_window/2) | (times > rts[:, None] + rt_window/2)
+    return np.where(outside | (intensities < noise), 0, intensities)
+
+
+def extract_raw_traces(file, lib, tolerance_ppm):
+    """
+    Extract raw ion chromatograms (no noise threshold or RT window) for the compounds in a library.
+
+    Uses the MS1 peak index of indexed files, the MS1 file of pre-split files
+    or else the complete mzML file.
+
+    Args:
+        file (str): Path to the mzML file.
+        lib (pd.DataFrame): Library targets as returned by load_library_targets.
+        tolerance_ppm (float): Mass tolerance in parts per million.
+
+    Returns:
+        tuple: (retention times of the MS1 scans, intensity matrix compounds x MS1 scans)
+    """
+    index = load_ms1_index(file)
+    if index is None:
+        # only MS1 is needed, use the pre-split MS1 file if available
+        exp = load_split_experiment(file, precursor_mzs=[])
+        if exp is None:
+            # load mzML file into exp
+            exp = MSExperiment()
+            MzMLFile().load(str(file), exp)
+        index = ms1_index_from_experiment(exp)
+    return np.array(index["rt"]), query_ms1_index(index, lib["PrecursorMz"], tolerance_ppm)
+
+
+def build_chromatograms(lib, times, intensities, noise, rt_window):
+    """
+    Filter raw ion chromatograms and integrate their peaks.
+
+    Args:
+        lib (pd.DataFrame): Library targets as returned by load_library_targets.
+        times (np.ndarray): Retention times of the MS1 scans.
+        intensities (np.ndarray): Raw intensity matrix (compounds x MS1 scans).
+        noise (int): Intensities below this value are set to zero.
+        rt_window (float): RT window in seconds around the library RT.
+
+    Returns:
+        EICResult: Compounds with "mz", "RT" and the peak features from integrate_peaks
+                   (incl. "area"), sorted by area.
+    """
+    intensities = filter_traces(times, intensities, lib["NormalizedRetentionTime"], noise, rt_window).astype(np.float32)
+    # integrate all traces at once against the retention time axis
+    peaks = integrate_peaks(times, intensities)
+    peaks.index = lib.index
+    lib = pd.concat([lib, peaks], axis=1)
 
     lib = lib.rename(columns={"NormalizedRetentionTime": "RT", "PrecursorMz": "mz"})
     lib.index.name = "name"
 
-    return lib.sort_values("area")
+    order = np.argsort(lib["area"].to_numpy(), kind="stable")
+    return EICResult(lib.iloc[order], times, intensities[order])
+
+
+def extract_ion_chromatograms(file, lib, noise, rt_window, tolerance_ppm):
+    """
+    Extract ion chromatograms from an mzML file for the compounds in a loaded library.
+
+    Args:
+        file (str): Path to the mzML file.
+        lib (pd.DataFrame): Library targets as returned by load_library_targets.
+        noise (int): Intensities below this value are set to zero.
+        rt_window (float): RT window in seconds around the library RT.
+        tolerance_ppm (float): Mass tolerance in parts per million.
+
+    Returns:
+        EICResult: See build_chromatograms.
+    """
+    times, intensities = extract_raw_traces(file, lib, tolerance_ppm)
+    return build_chromatograms(lib, times, intensities, noise, rt_window)
+
+
+@lru_cache(maxsize=8)
+def get_raw_traces(file, library, tolerance_ppm, openswath_metabolites=(), extra_targets=()):
+    """
+    Raw ion chromatograms of all library (and additional) targets, cached per process.
+
+    Args:
+        file (str): Path to the mzML file.
+        library (str): Path to the assay library (tsv).
+        tolerance_ppm (float): Mass tolerance in parts per million.
+        openswath_metabolites (tuple): Optionally restrict to these compound names.
+        extra_targets (tuple): Additional (name, m/z, RT) targets.
+
+    Returns:
+        tuple: (library targets, shared RT axis, float32 trace matrix), do not modify.
+    """
+    lib = load_library_targets(library, openswath_metabolites)
+    # ad-hoc targets as (name, m/z, RT) tuples
+    if extra_targets:
+        extra = pd.DataFrame(list(extra_targets), columns=["name", "PrecursorMz", "NormalizedRetentionTime"]).set_index("name")
+        lib = pd.concat([lib, extra])
+    times, intensities = extract_raw_traces(file, lib, tolerance_ppm)
+    return lib, times, intensities
+
+
+def get_extracted_ion_chromatogram(file, library, noise, rt_window, tolerance_ppm, openswath_metabolites=(), extra_targets=()):
+    # noise and RT window are applied to the cached raw traces, changing them does not re-extract
+    lib, times, intensities = get_raw_traces(file, library, tolerance_ppm, openswath_metabolites, extra_targets)
+    return build_chromatograms(lib, times, intensities, noise, rt_window)
+
+
+# library targets shared by all tasks of a worker process, set once by _init_eic_worker
+_worker_lib = None
+
+
+def _init_eic_worker(lib):
+    global _worker_lib
+    _worker_lib = lib
+
+
+def _extract_worker(file, noise, rt_window, tolerance_ppm):
+    return file, extract_ion_chromatograms(file, _worker_lib, noise, rt_window, tolerance_ppm)
+
+
+def get_eic_area_matrix(files, library, noise, rt_window, tolerance_ppm, max_workers=None, progress=None):
+    """
+    Extract ion chromatograms from many mzML files in parallel.
+
+    The library is read once and handed to every worker process on start-up,
+    each mzML file is processed by one worker.
+
+    Args:
+        files (list): Paths to the mzML files.
+        library (str): Path to the assay library (tsv).
+        noise (int): Intensities below this value are set to zero.
+        rt_window (float): RT window in seconds around the library RT.
+        tolerance_ppm (float): Mass tolerance in parts per million.
+        max_workers (int, optional): Number of worker processes. Defaults to as many as fit the
+                                     memory budget for the largest file (see admission.py).
+        progress (callable, optional): Called with (n_done, n_total, file) after each finished file.
+
+    Returns:
+        tuple: (pd.DataFrame with compounds x samples areas, dict of sample name -> EICResult)
+    """
+    lib = load_library_targets(library)
+    if not files:
+        return pd.DataFrame(index=pd.Index(lib.index, name="name")), {}
+    traces = {}
+    estimate = max((estimate_resources("eic", f) for f in files), key=lambda e: e["memory_mb"])
+    max_workers = max_workers or min(len(files), controller.max_parallel(estimate))
+    # the whole pool is admitted as one job, OpenSWATH runs wait while it uses the memory
+    pool = {"memory_mb": estimate["memory_mb"] * max_workers, "cpus": max_workers}
+    with controller.admit(pool), \
+            ProcessPoolExecutor(max_workers=max_workers, initializer=_init_eic_worker, initargs=(lib,)) as executor:
+        futures = [executor.submit(_extract_worker, str(f), noise, rt_window, tolerance_ppm) for f in files]
+        for i, future in enumerate(as_completed(futures), start=1):
+            file, eic = future.result()
+            traces[Path(file).stem] = eic
+            if progress:
+                progress(i, len(futures), file)
 
+    samples = [Path(f).stem for f in files]
+    areas = pd.DataFrame({sample: traces[sample].compounds["area"] for sample in samples}, index=lib.index)
+    areas.index.name = "name"
+    return areas, traces
@@ -0,0 +1,276 @@
+import argparse
+import json
+import shutil
+import time
+import uuid
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from pyopenms import *
+
+from .workspace import file_fingerprint, publish_directory
+
+# Derived artifacts of each mzML file are stored in <root>/<stem>-<fingerprint>/
+# together with a status.json listing the artifacts which are ready to use.
+
+
+def get_index_directory(mzML_file, root="mzML-index"):
+    """
+    Directory with the derived artifacts of an mzML file.
+
+    Args:
+        mzML_file (str): Path to the mzML file.
+        root (str): Root directory of all indexes.
+
+    Returns:
+        Path: Directory keyed by file name and fingerprint of the mzML file.
+    """
+    return Path(root, f"{Path(mzML_file).stem}-{file_fingerprint(mzML_file)}")
+
+
+def is_indexed(mzML_file, artifact="headers", root="mzML-index"):
+    """
+    Check if an artifact of an mzML file has been built.
+
+    Args:
+        mzML_file (str): Path to the mzML file.
+        artifact (str): Name of the artifact, one of ARTIFACT_BUILDERS.
+        root (str): Root directory of all indexes.
+
+    Returns:
+        bool: True if the artifact is ready.
+    """
+    status = Path(get_index_directory(mzML_file, root), "status.json")
+    return status.exists() and artifact in json.loads(status.read_text())["artifacts"]
+
+
+def build_scan_headers(exp, out_dir):
+    """
+    Scan header table with one row per spectrum, including the TIC and the MS2 precursors.
+
+    Columns: "spectrum", "native id", "mslevel", "RT", "precursormz", "TIC", "basepeak",
+    "peaks" and "ms1 RT" (RT of the last MS1 spectrum before each spectrum).
+    """
+    rows = []
+    ms1_rt = 0
+    for i, spec in enumerate(exp):
+        if spec.getMSLevel() == 1:
+            ms1_rt = spec.getRT()
+        _, intys = spec.get_peaks()
+        rows.append((
+            i,
+            spec.getNativeID(),
+            spec.getMSLevel(),
+            spec.getRT(),
+            spec.getPrecursors()[0].getMZ() if spec.getPrecursors() else 0,
+            intys.sum(),
+            intys.max() if intys.size else 0,
+            intys.size,
+            ms1_rt,
+        ))
+    df = pd.DataFrame(rows, columns=["spectrum", "native id", "mslevel", "RT", "precursormz", "TIC", "basepeak", "peaks", "ms1 RT"])
+    df.to_csv(Path(out_dir, "headers.tsv"), sep="\t", index=False)
+
+
+def ms1_index_from_experiment(exp):
+    """
+    MS1 peak index: all MS1 peaks sorted by m/z with their MS1 scan number and intensity.
+
+    Args:
+        exp (MSExperiment): Loaded experiment.
+
+    Returns:
+        dict: Arrays "mz" (sorted), "scan", "intensity" and "rt" (RT of each MS1 scan).
+    """
+    rts, mzs, intys, scans = [], [], [], []
+    for spec in exp:
+        if spec.getMSLevel() != 1:
+            continue
+        mz, inty = spec.get_peaks()
+        mzs.append(mz)
+        intys.append(inty)
+        scans.append(np.full(mz.size, len(rts), dtype=np.int32))
+        rts.append(spec.getRT())
+    mzs = np.concatenate(mzs) if mzs else np.array([])
+    order = np.argsort(mzs, kind="stable")
+    return {
+        "mz": mzs[order].astype(np.float64),
+        "scan": (np.concatenate(scans) if scans else np.array([], dtype=np.int32))[order],
+        "intensity": (np.concatenate(intys) if intys else np.array([]))[order].astype(np.float32),
+        "rt": np.array(rts, dtype=np.float64),
+    }
+
+
+def build_ms1_index(exp, out_dir):
+    """
+    MS1 peak index (see ms1_index_from_experiment) stored as numpy arrays which
+    can be memory mapped: ms1_mz.npy, ms1_scan.npy, ms1_intensity.npy and ms1_rt.npy.
+    """
+    for key, array in ms1_index_from_experiment(exp).items():
+        np.save(Path(out_dir, f"ms1_{key}.npy"), array)
+
+
+# artifact name -> function(exp, out_dir) writing the artifact into out_dir
+ARTIFACT_BUILDERS = {
+    "headers": build_scan_headers,
+    "ms1 index": build_ms1_index,
+}
+
+
+def load_scan_headers(mzML_file, root="mzML-index"):
+    """
+    Load the scan header table of an indexed mzML file.
+
+    Args:
+        mzML_file (str): Path to the mzML file.
+        root (str): Root directory of all indexes.
+
+    Returns:
+        pd.DataFrame: The scan header table, empty if the file is not indexed.
+    """
+    if not is_indexed(mzML_file, "headers", root):
+        return pd.DataFrame()
+    return pd.read_csv(Path(get_index_directory(mzML_file, root), "headers.tsv"), sep="\t")
+
+
+def load_ms1_index(mzML_file, root="mzML-index"):
+    """
+    Memory map the MS1 peak index of an indexed mzML file.
+
+    Args:
+        mzML_file (str): Path to the mzML file.
+        root (str): Root directory of all indexes.
+
+    Returns:
+        dict: Arrays "mz", "scan", "intensity" and "rt" (see build_ms1_index), None if not indexed.
+    """
+    if not is_indexed(mzML_file, "ms1 index", root):
+        return None
+    path = get_index_directory(mzML_file, root)
+    return {key: np.load(Path(path, f"ms1_{key}.npy"), mmap_mode="r") for key in ("mz", "scan", "intensity", "rt")}
+
+
+def load_spectra(mzML_file, indices):
+    """
+    Read single spectra from an indexed mzML file without loading the whole file.
+
+    Args:
+        mzML_file (str): Path to the (indexed) mzML file.
+        indices (list): Spectrum indices.
+
+    Returns:
+        list: (mzs, intensities) tuples in the order of indices.
+    """
+    od = OnDiscMSExperiment()
+    if not od.openFile(str(mzML_file)):
+        # no index in the mzML file, fall back to loading everything
+        exp = MSExperiment()
+        MzMLFile().load(str(mzML_file), exp)
+        return [exp.getSpectrum(int(i)).get_peaks() for i in indices]
+    return [od.getSpectrum(int(i)).get_peaks() for i in indices]
+
+
+def build_index(mzML_file, root="mzML-index"):
+    """
+    Build all artifacts of an mzML file.
+
+    The file is decoded once. Artifacts are written into a temporary directory
+    which is published when complete (see publish_directory), status.json marks
+    them as ready.
+
+    Args:
+        mzML_file (str): Path to the mzML file.
+        root (str): Root directory of all indexes.
+
+    Returns:
+        Path: The index directory.
+    """
+    out_dir = get_index_directory(mzML_file, root)
+    tmp_dir = Path(root, f".{out_dir.name}-{uuid.uuid4().hex[:8]}")
+    tmp_dir.mkdir(parents=True)
+    try:
+        exp = MSExperiment()
+        MzMLFile().load(str(mzML_file), exp)
+        for builder in ARTIFACT_BUILDERS.values():
+            builder(exp, tmp_dir)
+        status = {"file": Path(mzML_file).name, "fingerprint": out_dir.name.split("-")[-1],
+                  "artifacts": list(ARTIFACT_BUILDERS), "built": time.time()}
+        Path(tmp_dir, "status.json").write_text(json.dumps(status, indent=2))
+        # replaces an index outdated by new artifact types or built concurrently
+        publish_directory(tmp_dir, out_dir)
+    finally:
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+    return out_dir
+
+
+def get_catalog(mzML_dir="mzML-files", root="mzML-index"):
+    """
+    Indexing state of all mzML files in a directory.
+
+    Args:
+        mzML_dir (str): Directory with mzML files.
+        root (str): Root directory of all indexes.
+
+    Returns:
+        pd.DataFrame: One row per mzML file with "file", "size (MB)" and "ready" (all artifacts built).
+    """
+    rows = []
+    for path in sorted(Path(mzML_dir).glob("*.mzML")):
+        rows.append({"file": path.name, "size (MB)": round(path.stat().st_size / 1e6, 1),
+                     "ready": all(is_indexed(path, artifact, root) for artifact in ARTIFACT_BUILDERS)})
+    return pd.DataFrame(rows, columns=["file", "size (MB)", "ready"])
+
+
+def run_ingest_daemon(mzML_dir="mzML-files", root="mzML-index", max_workers=2, poll_interval=10, once=False):
+    """
+    Watch a directory and build the artifacts of new or changed mzML files in the background.
+
+    Args:
+        mzML_dir (str): Directory to watch.
+        root (str): Root directory of all indexes.
+        max_workers (int): Number of files indexed concurrently.
+        poll_interval (float): Seconds between directory scans.
+        once (bool): Index the current files and exit.
+
+    Returns:
+        None
+    """
+    in_progress = {}
+    failed = set()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            for path in Path(mzML_dir).glob("*.mzML"):
+                # skip files which are still being copied
+                if not once and time.time() - path.stat().st_mtime < poll_interval:
+                    continue
+                key = (path, file_fingerprint(path))
+                if key in in_progress or all(is_indexed(path, a, root) for a in ARTIFACT_BUILDERS):
+                    continue
+                print(f"Indexing {path.name}...")
+                in_progress[key] = executor.submit(build_index, str(path), root)
+            for key, future in list(in_progress.items()):
+                if future.done() and key not in failed:
+                    if future.exception():
+                        # keep the key, a failed file is retried only once it changes
+                        print(f"Indexing {key[0].name} failed: {future.exception()}")
+                        failed.add(key)
+                    else:
+                        print(f"Indexed {key[0].name}.")
+                        del in_progress[key]
+            if once and all(f.done() for f in in_progress.values()):
+                break
+            time.sleep(1 if once else poll_interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build derived artifacts for new mzML files in the background.")
+    parser.add_argument("-input_directory", help="Directory to watch for mzML files.", default="mzML-files")
+    parser.add_argument("-index_directory", help="Directory for the derived artifacts.", default="mzML-index")
+    parser.add_argument("-threads", help="Number of files indexed concurrently.", type=int, default=2)
+    parser.add_argument("-poll_interval", help="Seconds between directory scans.", type=float, default=10)
+    parser.add_argument("-once", help="Index the current files and exit.", action="store_true")
+    args = parser.parse_args()
+
+    run_ingest_daemon(args.input_directory, args.index_directory, args.threads, args.poll_interval, args.once)
@@ -0,0 +1,277 @@
+import argparse
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+import uuid
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import pandas as pd
+
+from .runopenswath import build_openswath_command
+from .admission import estimate_resources, run_admitted
+
+# A job queue on a shared directory, usable from several compute nodes.
+# Jobs are json files moving between state directories with atomic renames:
+#   pending/<id>.json -> running/<id>.json -> done/<id>.json or failed/<id>.json
+# A running job file is touched by its worker as heartbeat, running jobs
+# without heartbeat for longer than the stale timeout are moved back to pending.
+# A worker whose job was reclaimed (file gone or claimed by another worker)
+# kills its run and discards the result.
+STATES = ("pending", "running", "done", "failed")
+
+
+def init_queue(queue_dir):
+    """
+    Create the state directories of a job queue.
+
+    Args:
+        queue_dir (str): Shared queue directory.
+
+    Returns:
+        None
+    """
+    for state in STATES + ("workers",):
+        Path(queue_dir, state).mkdir(parents=True, exist_ok=True)
+
+
+def _write_json(path, data):
+    # write to a unique temporary file and rename, readers never see partial files
+    tmp = Path(path).with_suffix(f".{uuid.uuid4().hex}.tmp")
+    tmp.write_text(json.dumps(data, indent=2))
+    tmp.replace(path)
+
+
+def submit_openswath_job(queue_dir, mzML_file, library, windows, rt_window, out_dir="results", additional=[]):
+    """
+    Add an OpenSwathWorkflow run to the queue.
+
+    All paths must be reachable from the worker nodes (e.g. on the shared mount).
+
+    Args:
+        queue_dir (str): Shared queue directory.
+        mzML_file (str): Input mzML file.
+        library (str): Transition library.
+        windows (str): SWATH window file.
+        rt_window (str): RT extraction window in seconds.
+        out_dir (str): Output directory for the result tsv file.
+        additional (list): Additional OpenSwathWorkflow arguments.
+
+    Returns:
+        str: The job id.
+    """
+    init_queue(queue_dir)
+    job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    job = {
+        "id": job_id,
+        "mzML_file": str(Path(mzML_file).resolve()),
+        "library": str(Path(library).resolve()),
+        "windows": str(Path(windows).resolve()),
+        "rt_window": str(rt_window),
+        "out_dir": str(Path(out_dir).resolve()),
+        "additional": list(additional),
+        "submitted": time.time(),
+    }
+    _write_json(Path(queue_dir, "pending", job_id + ".json"), job)
+    return job_id
+
+
+def get_queue_status(queue_dir):
+    """
+    List all jobs of the queue with their state.
+
+    Args:
+        queue_dir (str): Shared queue directory.
+
+    Returns:
+        pd.DataFrame: One row per job with "id", "state", "file", "worker" and "last update".
+    """
+    rows = []
+    for state in STATES:
+        for path in Path(queue_dir, state).glob("*.json"):
+            try:
+                job = json.loads(path.read_text())
+            except (OSError, ValueError):
+                # the job moved on while reading
+                continue
+            rows.append({"id": job["id"], "state": state, "file": Path(job["mzML_file"]).name,
+                         "worker": job.get("worker", ""), "last update": pd.Timestamp(path.stat().st_mtime, unit="s")})
+    return pd.DataFrame(rows, columns=["id", "state", "file", "worker", "last update"])
+
+
+def reclaim_stale_jobs(queue_dir, stale_timeout=300):
+    """
+    Move running jobs without recent heartbeat back to pending.
+
+    Args:
+        queue_dir (str): Shared queue directory.
+        stale_timeout (float): Seconds without heartbeat after which a job counts as abandoned.
+
+    Returns:
+        list: Ids of the reclaimed jobs.
+    """
+    reclaimed = []
+    now = time.time()
+    for path in Path(queue_dir, "running").glob("*.json"):
+        try:
+            if now - path.stat().st_mtime > stale_timeout:
+                path.rename(Path(queue_dir, "pending", path.name))
+                reclaimed.append(path.stem)
+        except OSError:
+            # finished or reclaimed by another worker in the meantime
+            continue
+    return reclaimed
+
+
+def claim_job(queue_dir, worker):
+    """
+    Claim the oldest pending job.
+
+    Args:
+        queue_dir (str): Shared queue directory.
+        worker (str): Name of the claiming worker.
+
+    Returns:
+        dict: The claimed job, None if no job is pending.
+    """
+    for path in sorted(Path(queue_dir, "pending").glob("*.json")):
+        running = Path(queue_dir, "running", path.name)
+        try:
+            # rename is atomic, only one worker can win a job
+            path.rename(running)
+            # the first heartbeat, the renamed file still has the submission time
+            os.utime(running)
+            job = json.loads(running.read_text())
+        except OSError:
+            continue
+        job["worker"] = worker
+        job["started"] = time.time()
+        _write_json(running, job)
+        return job
+    return None
+
+
+def _heartbeat(running, worker):
+    # touch the job file without re-creating it, False if the job was reclaimed
+    try:
+        os.utime(running)
+        return json.loads(running.read_text()).get("worker") == worker
+    except (OSError, ValueError):
+        return False
+
+
+def run_job(queue_dir, job, heartbeat_interval=10):
+    """
+    Run a claimed OpenSwathWorkflow job, keeping its heartbeat alive.
+
+    The result is written to a temporary file and renamed into the output
+    directory once complete.
+
+    Args:
+        queue_dir (str): Shared queue directory.
+        job (dict): The claimed job.
+        heartbeat_interval (float): Seconds between heartbeats.
+
+    Returns:
+        bool: True if the run produced a result file, False if it failed or the job was reclaimed.
+    """
+    running = Path(queue_dir, "running", job["id"] + ".json")
+    Path(job["out_dir"]).mkdir(parents=True, exist_ok=True)
+    out_file = Path(job["out_dir"], f"{Path(job['mzML_file']).stem}_{Path(job['library']).stem}_{job['rt_window']}s.tsv")
+    tmp_file = Path(job["out_dir"], ".tmp", f"{job['id']}.tsv")
+    tmp_file.parent.mkdir(exist_ok=True)
+    command = build_openswath_command(
+        job["mzML_file"], job["library"], job["windows"], str(tmp_file),
+        ["-rt_extraction_window", job["rt_window"]] + job["additional"],
+    )
+    print("Running command:", subprocess.list2cmdline(command))
+    estimate = estimate_resources("openswath", job["mzML_file"], job["library"])
+    started, lost = [], threading.Event()
+
+    def on_start(process):
+        started.append(process)
+        if lost.is_set():
+            process.kill()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(run_admitted, command, estimate, "openswath", on_start=on_start)
+        while True:
+            if not _heartbeat(running, job["worker"]):
+                print(f"{job['worker']}: lost job {job['id']}, it was reclaimed")
+                lost.set()
+                if started:
+                    started[0].kill()
+                future.result()
+                tmp_file.unlink(missing_ok=True)
+                return False
+            try:
+                process = future.result(timeout=heartbeat_interval)
+                break
+            except TimeoutError:
+                continue
+
+    if not _heartbeat(running, job["worker"]):
+        tmp_file.unlink(missing_ok=True)
+        return False
+    success = process.returncode == 0 and tmp_file.exists()
+    if success:
+        tmp_file.replace(out_file)
+        job["result"] = str(out_file)
+    elif tmp_file.exists():
+        tmp_file.unlink()
+    job["returncode"] = process.returncode
+    job["finished"] = time.time()
+    _write_json(running, job)
+    running.replace(Path(queue_dir, "done" if success else "failed", running.name))
+    return success
+
+
+def run_worker(queue_dir, worker="", poll_interval=5, heartbeat_interval=10, stale_timeout=300, exit_when_empty=False):
+    """
+    Worker loop: reclaim stale jobs, claim pending jobs and run them.
+
+    Args:
+        queue_dir (str): Shared queue directory.
+        worker (str): Worker name, defaults to host name and process id.
+        poll_interval (float): Seconds to wait when no job is pending.
+        heartbeat_interval (float): Seconds between heartbeats.
+        stale_timeout (float): Seconds without heartbeat after which a job is reclaimed.
+        exit_when_empty (bool): Stop once no job is pending instead of polling.
+
+    Returns:
+        int: Number of processed jobs.
+    """
+    init_queue(queue_dir)
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    worker_file = Path(queue_dir, "workers", worker + ".json")
+    processed = 0
+    while True:
+        _write_json(worker_file, {"worker": worker, "heartbeat": time.time(), "processed": processed})
+        reclaim_stale_jobs(queue_dir, stale_timeout)
+        job = claim_job(queue_dir, worker)
+        if job is None:
+            if exit_when_empty:
+                break
+            time.sleep(poll_interval)
+            continue
+        print(f"{worker}: running job {job['id']}")
+        run_job(queue_dir, job, heartbeat_interval)
+        processed += 1
+    worker_file.unlink(missing_ok=True)
+    return processed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenSWATH worker processing jobs from a shared queue directory.")
+    parser.add_argument("-queue_directory", help="Shared queue directory.", default="job-queue")
+    parser.add_argument("-name", help="Worker name (default: host name and process id).", default="")
+    parser.add_argument("-poll_interval", help="Seconds to wait when no job is pending.", type=float, default=5)
+    parser.add_argument("-heartbeat_interval", help="Seconds between heartbeats of running jobs.", type=float, default=10)
+    parser.add_argument("-stale_timeout", help="Seconds without heartbeat after which a running job is reclaimed.", type=float, default=300)
+    parser.add_argument("-exit_when_empty", help="Stop once the queue is empty.", action="store_true")
+    args = parser.parse_args()
+
+    run_worker(args.queue_directory, args.name, args.poll_interval, args.heartbeat_interval,
+               args.stale_timeout, args.exit_when_empty)
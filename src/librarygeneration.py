@@ -1,12 +1,190 @@
 from pyopenms import *
+import uuid
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 
+from .workspace import file_fingerprint
+from .ingest import load_scan_headers, load_spectra
+
+
+def find_best_spectra(exp, precursor_mzs, tolerance_ppm):
+    """
+    Find the MS2 spectrum with the highest TIC for each precursor m/z in a single pass.
+
+    Args:
+        exp (MSExperiment): Loaded DDA experiment.
+        precursor_mzs (list): Precursor m/z values.
+        tolerance_ppm (float): Mass tolerance in parts per million.
+
+    Returns:
+        dict: Precursor m/z -> (mzs, intensities, ms1 RT) of the best spectrum, empty arrays if none matched.
+    """
+    targets = np.array(precursor_mzs, dtype=float)
+    deltas = (tolerance_ppm / 1000000) * targets
+    tics = np.zeros(targets.size)
+    best = {mz: (np.array([]), np.array([]), 0) for mz in precursor_mzs}
+    ms1_rt_tmp = 0  # in case the first spec is MS2
+    for spec in exp:
+        if spec.getMSLevel() == 1:
+            ms1_rt_tmp = spec.getRT()
+        if spec.getMSLevel() == 2:
+            prec = spec.getPrecursors()[0].getMZ()
+            matches = np.flatnonzero((targets - deltas < prec) & (prec < targets + deltas))
+            if not matches.size:
+                continue
+            mzs_tmp, intys_tmp = spec.get_peaks()
+            tic = intys_tmp.sum()
+            for i in matches[tics[matches] < tic]:
+                tics[i] = tic
+                best[precursor_mzs[i]] = (mzs_tmp, intys_tmp, ms1_rt_tmp)
+    return best
+
+
+def find_best_spectra_in_headers(headers, precursor_mzs, tolerance_ppm):
+    """
+    Index of the MS2 spectrum with the highest TIC for each precursor m/z from a scan header table.
+
+    Args:
+        headers (pd.DataFrame): Scan header table (see src.ingest.build_scan_headers).
+        precursor_mzs (list): Precursor m/z values.
+        tolerance_ppm (float): Mass tolerance in parts per million.
+
+    Returns:
+        dict: Precursor m/z -> spectrum index, None if no spectrum matched.
+    """
+    ms2 = headers[(headers["mslevel"] == 2) & (headers["TIC"] > 0)]
+    prec = ms2["precursormz"].to_numpy()
+    tic = ms2["TIC"].to_numpy()
+    best = {}
+    for mz in precursor_mzs:
+        delta = (tolerance_ppm / 1000000) * mz
+        tics = np.where((mz - delta < prec) & (prec < mz + delta), tic, 0)
+        best[mz] = int(ms2["spectrum"].iloc[tics.argmax()]) if tics.size and tics.max() > 0 else None
+    return best
+
+
+def get_best_spectra(mzML_file, precursor_mzs, tolerance_ppm, cache_dir="library-cache"):
+    """
+    Best MS2 spectra per precursor, cached per (mzML file, precursor m/z, tolerance).
+
+    Only precursors without a cached result are searched, the raw file is not
+    loaded at all if every precursor is cached.
+
+    Args:
+        mzML_file (str): Path to the mzML file.
+        precursor_mzs (list): Precursor m/z values.
+        tolerance_ppm (float): Mass tolerance in parts per million.
+        cache_dir (str): Directory for the cache files.
+
+    Returns:
+        dict: Precursor m/z -> (mzs, intensities, ms1 RT), see find_best_spectra.
+    """
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    cache_file = Path(cache_dir, f"{Path(mzML_file).stem}-{file_fingerprint(mzML_file)}.pkl")
+    cache = pd.read_pickle(cache_file) if cache_file.exists() else {}
+
+    missing = list(dict.fromkeys(mz for mz in precursor_mzs if (mz, tolerance_ppm) not in cache))
+    if missing:
+        print(f"Searching {len(missing)} of {len(precursor_mzs)} precursors in {mzML_file}...")
+        headers = load_scan_headers(mzML_file)
+        if not headers.empty:
+            # indexed file: select by TIC from the scan headers, read only the selected spectra
+            best = find_best_spectra_in_headers(headers, missing, tolerance_ppm)
+            found = [mz for mz in missing if best[mz] is not None]
+            peaks = dict(zip(found, load_spectra(mzML_file, [best[mz] for mz in found])))
+            ms1_rts = headers.set_index("spectrum")["ms1 RT"]
+            for mz in missing:
+                if best[mz] is None:
+                    cache[(mz, tolerance_ppm)] = (np.array([]), np.array([]), 0)
+                else:
+                    cache[(mz, tolerance_ppm)] = (*peaks[mz], ms1_rts[best[mz]])
+        else:
+            exp = MSExperiment()
+            MzMLFile().load(mzML_file, exp)
+            for mz, spectrum in find_best_spectra(exp, missing, tolerance_ppm).items():
+                cache[(mz, tolerance_ppm)] = spectrum
+        # write to a temporary file first, concurrent sessions never read partial files
+        tmp_file = cache_file.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        pd.to_pickle(cache, tmp_file)
+        tmp_file.replace(cache_file)
+
+    return {mz: cache[(mz, tolerance_ppm)] for mz in precursor_mzs}
+
+
+def select_transitions(mzs, intys, precursor_mz, top_n, exclude_precursor_mass, tolerance_ppm):
+    """
+    Select and normalize the top n transitions of a spectrum.
+
+    Args:
+        mzs (np.ndarray): Peak m/z values.
+        intys (np.ndarray): Peak intensities.
+        precursor_mz (float): Precursor m/z.
+        top_n (int): Number of top intensity transitions to select.
+        exclude_precursor_mass (bool): Whether to exclude precursor masses from transitions.
+        tolerance_ppm (float): Mass tolerance in parts per million.
+
+    Returns:
+        tuple: (mzs, intensities) of the selected transitions.
+    """
+    if mzs.any():
+        delta = (tolerance_ppm / 1000000) * precursor_mz
+        # Exclude masses, depends on keeping unfractionated precursor mass
+        if exclude_precursor_mass:
+            condition = mzs < precursor_mz - 1
+        else:
+            condition = mzs < precursor_mz + delta
+        mzs = mzs[condition]
+        intys = intys[condition]
+        # # Remove peaks with inty < 5% of top max
+        # condition = intys > 1000
+        # intys = intys[condition]
+        # mzs = mzs[condition]
+        if mzs.any():
+            # Get indices of top_n highest intensity peaks
+            sorted_indeces = np.argsort(intys)[-top_n:]
+            mzs = mzs[sorted_indeces]
+            intys = intys[sorted_indeces]
+            # Normalize intensity values
+            intys = intys / intys.max()
+    return mzs, intys
+
+
+def build_library(df, collision_energy):
+    """
+    Build the assay library table from precursors with selected transitions.
+
+    Args:
+        df (pd.DataFrame): Precursors with "name", "mz", "transition mzs", "transition intys" and "transition ms1 rt".
+        collision_energy (int): Collision energy value.
+
+    Returns:
+        pd.DataFrame: DataFrame containing transition information.
+    """
+    # Build transition table
+    def build_transition_table(df):
+        for _, row in df.iterrows():
+            for mz, inty in zip(row["transition mzs"], row["transition intys"]):
+                yield row["name"], row["mz"], mz, inty, row["transition ms1 rt"], row["name"], collision_energy
+
+    # Create a DataFrame from the built transition table
+    return pd.DataFrame(np.fromiter(build_transition_table(df), dtype=[("CompoundName", "U100"), ("PrecursorMz", "f"),
+                                                                       ("ProductMz", "f"), (
+                                                                           "LibraryIntensity", "f"),
+                                                                       ("NormalizedRetentionTime", "f"),
+                                                                       ("TransitionGroupId",
+                                                                        "U100"),
+                                                                       ("CollisionEnergy", "i")]))
+
 
 def generate_library(precursor_file, mzML_file, top_n, exclude_precursor_mass, tolerance_ppm, collision_energy):
     """
     Generate a library of transitions for metabolites.
 
+    The best spectrum per precursor is cached (see get_best_spectra), changing
+    top_n, exclude_precursor_mass or collision_energy does not read the mzML file again.
+
     Args:
         precursor_file (str): Path to the precursor file (CSV format).
         mzML_file (str): Path to the mzML file.
@@ -22,9 +200,7 @@ def generate_library(precursor_file, mzML_file, top_n, exclude_precursor_mass, t
     df = pd.read_csv(precursor_file, sep="\t", names=[
                      "name", "mz", "sum formula"])
 
-    # Load mzML file into exp
-    exp = MSExperiment()
-    MzMLFile().load(mzML_file, exp)
+    best = get_best_spectra(mzML_file, df["mz"].tolist(), tolerance_ppm)
 
     def get_transitions(metabolite):
         """
@@ -36,69 +212,106 @@ def generate_library(precursor_file, mzML_file, top_n, exclude_precursor_mass, t
         Returns:
             pd.Series: Transition information.
         """
-        tic = 0
-        mzs = np.array([])
-        intys = np.array([])
-        delta = (tolerance_ppm / 1000000) * metabolite["mz"]
-        print(f"{metabolite['name']} mz: {metabolite['mz']}...")
-        ms1_rt = 0
-        ms1_rt_tmp = 0  # in case the first spec is MS2
-        for spec in exp:
-            if spec.getMSLevel() == 1:
-                ms1_rt_tmp = spec.getRT()
-            if spec.getMSLevel() == 2:
-                prec = spec.getPrecursors()[0].getMZ()
-                if metabolite["mz"] - delta < prec < metabolite["mz"] + delta:
-                    mzs_tmp, intys_tmp = spec.get_peaks()
-                    if intys_tmp.sum() > tic:
-                        tic = intys_tmp.sum()
-                        mzs = mzs_tmp
-                        intys = intys_tmp
-                        ms1_rt = ms1_rt_tmp
-        if mzs.any():
-            # Exclude masses, depends on keeping unfractionated precursor mass
-            if exclude_precursor_mass:
-                condition = mzs < metabolite["mz"] - 1
-            else:
-                condition = mzs < metabolite["mz"] + delta
-            mzs = mzs[condition]
-            intys = intys[condition]
-            # # Remove peaks with inty < 5% of top max
-            # condition = intys > 1000
-            # intys = intys[condition]
-            # mzs = mzs[condition]
-            if mzs.any():
-                # Get indices of top_n highest intensity peaks
-                sorted_indeces = np.argsort(intys)[-top_n:]
-                mzs = mzs[sorted_indeces]
-                intys = intys[sorted_indeces]
-                # Normalize intensity values
-                intys = intys / intys.max()
-
+        mzs, intys, ms1_rt = best[metabolite["mz"]]
+        mzs, intys = select_transitions(mzs, intys, metabolite["mz"], top_n, exclude_precursor_mass, tolerance_ppm)
         return pd.Series({"transition mzs": mzs, "transition intys": intys, "transition ms1 rt": ms1_rt})
 
     # Apply the get_transitions function to each row
     df[["transition mzs", "transition intys", "transition ms1 rt"]
        ] = df.apply(get_transitions, axis=1)
 
-    # Build transition table
-    def build_transition_table(df):
-        for _, row in df.iterrows():
-            for mz, inty in zip(row["transition mzs"], row["transition intys"]):
-                yield row["name"], row["mz"], mz, inty, row["transition ms1 rt"], row["name"], collision_energy
+    # Merge rows where fragment masses are very similar
 
-    # Create a DataFrame from the built transition table
-    df = pd.DataFrame(np.fromiter(build_transition_table(df), dtype=[("CompoundName", "U100"), ("PrecursorMz", "f"),
-                                                                     ("ProductMz", "f"), (
-                                                                         "LibraryIntensity", "f"),
-                                                                     ("NormalizedRetentionTime", "f"),
-                                                                     ("TransitionGroupId",
-                                                                      "U100"),
-                                                                     ("CollisionEnergy", "i")]))
+    return build_library(df, collision_energy)
 
-    # Merge rows where fragment masses are very similar
 
-    return df
+def merge_spectra(spectra, precursor_mz, binning_width_ppm=50.0):
+    """
+    Merge MS2 spectra of the same precursor into a consensus spectrum with SpectraMerger.
+
+    Args:
+        spectra (list): List of (mzs, intensities) tuples.
+        precursor_mz (float): Precursor m/z.
+        binning_width_ppm (float): m/z binning width in ppm.
+
+    Returns:
+        tuple: (mzs, intensities) of the merged spectrum, the most intense input if merging fails.
+    """
+    spectra = [(mzs, intys) for mzs, intys in spectra if mzs.any()]
+    if len(spectra) < 2:
+        return spectra[0] if spectra else (np.array([]), np.array([]))
+    exp = MSExperiment()
+    for mzs, intys in spectra:
+        spec = MSSpectrum()
+        spec.setMSLevel(2)
+        # identical RT and precursor, all spectra fall into one merge block
+        spec.setRT(precursor_mz)
+        p = Precursor()
+        p.setMZ(precursor_mz)
+        spec.setPrecursors([p])
+        spec.set_peaks((mzs, intys))
+        exp.addSpectrum(spec)
+    exp.updateRanges()
+    exp.sortSpectra()
+    sm = SpectraMerger()
+    smp = sm.getParameters()
+    smp.setValue("mz_binning_width", binning_width_ppm)
+    sm.setParameters(smp)
+    try:
+        sm.mergeSpectraPrecursors(exp)
+    except RuntimeError:
+        print(f"WARNING: can't merge spectra for precursor {precursor_mz}")
+    merged = max((spec.get_peaks() for spec in exp), key=lambda peaks: peaks[1].sum())
+    return merged
+
+
+def _best_spectra_worker(mzML_file, precursor_mzs, tolerance_ppm):
+    return get_best_spectra(mzML_file, precursor_mzs, tolerance_ppm)
+
+
+def generate_library_from_files(precursor_file, mzML_files, top_n, exclude_precursor_mass, tolerance_ppm,
+                                collision_energy, consensus=True, max_workers=None):
+    """
+    Generate a library of transitions for metabolites from multiple DDA files.
+
+    The files are searched in parallel processes (each with its own cache, see
+    get_best_spectra). Per precursor either the best spectra of all files are
+    merged into a consensus spectrum or the spectrum with the highest TIC is used.
+
+    Args:
+        precursor_file (str): Path to the precursor file (CSV format).
+        mzML_files (list): Paths to the mzML files.
+        top_n (int): Number of top intensity transitions to select.
+        exclude_precursor_mass (bool): Whether to exclude precursor masses from transitions.
+        tolerance_ppm (float): Mass tolerance in parts per million.
+        collision_energy (int): Collision energy value.
+        consensus (bool): Merge spectra across files instead of taking the highest TIC spectrum.
+        max_workers (int, optional): Number of worker processes.
+
+    Returns:
+        pd.DataFrame: DataFrame containing transition information.
+    """
+    df = pd.read_csv(precursor_file, sep="\t", names=[
+                     "name", "mz", "sum formula"])
+    precursor_mzs = df["mz"].tolist()
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        per_file = list(executor.map(_best_spectra_worker, mzML_files,
+                                     [precursor_mzs] * len(mzML_files), [tolerance_ppm] * len(mzML_files)))
+
+    def get_transitions(metabolite):
+        candidates = [best[metabolite["mz"]] for best in per_file]
+        # RT of the most intense spectrum across all files
+        mzs, intys, ms1_rt = max(candidates, key=lambda c: c[1].sum() if c[1].size else 0)
+        if consensus:
+            mzs, intys = merge_spectra([(c[0], c[1]) for c in candidates], metabolite["mz"])
+        mzs, intys = select_transitions(mzs, intys, metabolite["mz"], top_n, exclude_precursor_mass, tolerance_ppm)
+        return pd.Series({"transition mzs": mzs, "transition intys": intys, "transition ms1 rt": ms1_rt})
+
+    df[["transition mzs", "transition intys", "transition ms1 rt"]
+       ] = df.apply(get_transitions, axis=1)
+
+    return build_library(df, collision_energy)
 
 
 def generate_transitions_from_json_data(data, top_n = 0, exclude_precursor_mass=True):
@@ -3,12 +3,43 @@ import pandas as pd
 import plotly.express as px
 from pyopenms import *
 import numpy as np
+from .swathsplit import load_split_experiment
+from .swathwindows import get_swath_windows
+from .ingest import load_scan_headers, load_spectra
+from .spectralsearch import build_library_index, search_spectra
 
 
-def get_ms2_df(file):
-    exp = MSExperiment()
-    MzMLFile().load(file, exp)
+def _filter_precursor_windows(df, file, precursor_mzs):
+    # keep MS2 spectra from the SWATH windows (derived from the spectrum headers) containing the precursors
+    windows, _ = get_swath_windows(file)
+    if windows.empty:
+        # no isolation windows (e.g. DDA data), match the precursor m/z
+        windows = pd.DataFrame({"start": [mz - 0.5 for mz in precursor_mzs], "stop": [mz + 0.5 for mz in precursor_mzs]})
+    mzs = pd.Series(precursor_mzs, dtype=float)
+    windows = windows[[((start <= mzs) & (mzs <= stop)).any() for start, stop in zip(windows["start"], windows["stop"])]]
+    keep = np.zeros(len(df), dtype=bool)
+    for start, stop in zip(windows["start"], windows["stop"]):
+        keep |= (df["precursormz"] >= start).to_numpy() & (df["precursormz"] <= stop).to_numpy()
+    return df[keep].reset_index(drop=True)
+
+
+def get_ms2_df(file, precursor_mzs=None):
+    # with precursors given only the matching SWATH windows of a pre-split file are loaded
+    exp = None
+    if precursor_mzs:
+        exp = load_split_experiment(file, precursor_mzs, ms1=False)
+        if exp is not None:
+            precursor_mzs = None
+    if exp is None:
+        # indexed files: list spectra from the scan headers, peaks are loaded on demand
+        headers = load_scan_headers(file)
+        if not headers.empty:
+            df = headers[headers["mslevel"] == 2].reset_index(drop=True)
+            return _filter_precursor_windows(df, file, precursor_mzs) if precursor_mzs else df
+        exp = MSExperiment()
+        MzMLFile().load(file, exp)
     df = exp.get_df()
+    df.insert(0, "native id", [spec.getNativeID() for spec in exp])
     df.insert(0, "mslevel", [spec.getMSLevel() for spec in exp])
     df.insert(
         0,
@@ -21,20 +52,84 @@ def get_ms2_df(file):
     df = df[df["mslevel"] == 2]
     df = df.reset_index()
     df = df.drop("index", axis=1)
-    return df
+    return _filter_precursor_windows(df, file, precursor_mzs) if precursor_mzs else df
+
+
+@st.cache_data
+def get_library_hits(file, library, precursor_tolerance, top_n=3):
+    """
+    Search all MS2 spectra of an mzML file against an assay library.
+
+    Indexed files are read spectrum by spectrum through the scan headers,
+    otherwise the whole file is loaded.
+
+    Args:
+        file (str): Path to the mzML file.
+        library (str): Path to the assay library (tsv).
+        precursor_tolerance (float): Maximum precursor m/z difference in Da.
+        top_n (int): Number of hits per spectrum.
 
+    Returns:
+        pd.DataFrame: Hits (see search_spectra) with "RT" and "precursormz" of the query spectrum,
+                      "spectrum" is its index in the mzML file, "native id" its native ID (if known).
+    """
+    headers = load_scan_headers(file)
+    if not headers.empty:
+        ms2 = headers[headers["mslevel"] == 2].reset_index(drop=True)
+        peaks = load_spectra(file, ms2["spectrum"].tolist())
+        ids = ms2["native id"] if "native id" in ms2 else None
+    else:
+        exp = MSExperiment()
+        MzMLFile().load(file, exp)
+        spectra = [(i, spec) for i, spec in enumerate(exp) if spec.getMSLevel() == 2]
+        ms2 = pd.DataFrame({
+            "spectrum": [i for i, _ in spectra],
+            "RT": [spec.getRT() for _, spec in spectra],
+            "precursormz": [spec.getPrecursors()[0].getMZ() if spec.getPrecursors() else 0 for _, spec in spectra],
+        })
+        peaks = [spec.get_peaks() for _, spec in spectra]
+        ids = pd.Series([spec.getNativeID() for _, spec in spectra])
+    hits = search_spectra([p[0] for p in peaks], [p[1] for p in peaks], ms2["precursormz"].to_numpy(),
+                          build_library_index(library), precursor_tolerance, top_n)
+    query = hits["spectrum"].to_numpy(dtype=int)
+    hits["spectrum"] = ms2["spectrum"].to_numpy()[query]
+    if ids is not None:
+        hits.insert(1, "native id", ids.to_numpy()[query])
+    hits.insert(1, "RT", ms2["RT"].to_numpy()[query])
+    hits.insert(2, "precursormz", ms2["precursormz"].to_numpy()[query])
+    return hits
 
-def get_ms2_spec_plot(df, spec):
+
+def get_spectrum_hits(hits, spectrum):
+    """
+    Library hits of one spectrum.
+
+    Args:
+        hits (pd.DataFrame): Hits of a file (see get_library_hits).
+        spectrum (pd.Series): The spectrum, a row of get_ms2_df.
+
+    Returns:
+        pd.DataFrame: The hits of this spectrum, matched by native ID or spectrum index.
+    """
+    for key in ("native id", "spectrum"):
+        if key in hits and key in spectrum.index:
+            return hits[hits[key] == spectrum[key]]
+    return hits.iloc[:0]
+
+
+def get_ms2_spec_plot(df, spec, file=""):
     def create_spectra(x, y, zero=0):
         x = np.repeat(x, 3)
         y = np.repeat(y, 3)
         y[::3] = y[2::3] = zero
         return pd.DataFrame({"mz": x, "intensity": y})
 
-    df = create_spectra(
-        df.loc[int(spec.split(" ")[0]), "mzarray"],
-        df.loc[int(spec.split(" ")[0]), "intarray"],
-    )
+    i = int(spec.split(" ")[0])
+    if "mzarray" in df.columns:
+        mzs, intys = df.loc[i, "mzarray"], df.loc[i, "intarray"]
+    else:
+        mzs, intys = load_spectra(file, [df.loc[i, "spectrum"]])[0]
+    df = create_spectra(mzs, intys)
     fig = px.line(df, x="mz", y="intensity")
     fig.update_layout(
         showlegend=False,
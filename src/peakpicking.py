@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+
+
+def smooth(intensities, window=5):
+    """
+    Moving average smoothing along the scan axis of a (compounds x scans) matrix.
+
+    Args:
+        intensities (np.ndarray): 2D intensity matrix.
+        window (int): Number of scans in the (odd) smoothing window, 1 disables smoothing.
+
+    Returns:
+        np.ndarray: Smoothed matrix with the same shape.
+    """
+    intensities = np.asarray(intensities, dtype=float)
+    if window < 2 or intensities.shape[1] == 0:
+        return intensities
+    half = window // 2
+    padded = np.pad(intensities, ((0, 0), (half, half)), mode="edge")
+    cumsum = np.cumsum(padded, axis=1)
+    cumsum = np.concatenate([np.zeros((cumsum.shape[0], 1)), cumsum], axis=1)
+    return (cumsum[:, 2 * half + 1:] - cumsum[:, :-2 * half - 1]) / (2 * half + 1)
+
+
+def _interpolate_crossing(times, y, level, lower, upper):
+    """RT where y crosses level between scan indices lower and upper (per row)."""
+    rows = np.arange(y.shape[0])
+    y_lower, y_upper = y[rows, lower], y[rows, upper]
+    t_lower, t_upper = times[lower], times[upper]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fraction = np.where(y_upper != y_lower, (level - y_lower) / (y_upper - y_lower), 0)
+    return t_lower + np.clip(fraction, 0, 1) * (t_upper - t_lower)
+
+
+def integrate_peaks(times, intensities, smoothing_window=5, boundary_fraction=0.05):
+    """
+    Find and integrate the most intense peak of every trace in a (compounds x scans) matrix.
+
+    All traces are processed at once: the matrix is smoothed, the peak is located
+    at the maximum of the smoothed trace and its boundaries are the closest scans
+    left and right of it which drop below boundary_fraction of the maximum or are
+    a local minimum. The apex is the raw maximum between the boundaries. The raw
+    intensities between the boundaries are integrated with the trapezoid rule
+    against the retention time axis and the FWHM is interpolated from the half
+    height crossings of the raw trace around the apex.
+
+    Args:
+        times (np.ndarray): Retention times of the scans (shared by all traces).
+        intensities (np.ndarray): 2D intensity matrix (compounds x scans).
+        smoothing_window (int): Number of scans for moving average smoothing.
+        boundary_fraction (float): Fraction of the apex intensity that ends a peak.
+
+    Returns:
+        pd.DataFrame: One row per trace with "apex RT", "apex intensity", "start RT",
+                      "end RT", "FWHM" and "area". Traces without signal have zero values.
+    """
+    times = np.asarray(times, dtype=float)
+    raw = np.asarray(intensities, dtype=float).reshape(-1, times.size)
+    columns = ["apex RT", "apex intensity", "start RT", "end RT", "FWHM", "area"]
+    if raw.shape[0] == 0 or times.size == 0:
+        return pd.DataFrame(np.zeros((raw.shape[0], len(columns))), columns=columns)
+
+    y = smooth(raw, smoothing_window)
+    rows = np.arange(y.shape[0])
+    scans = np.arange(y.shape[1])
+    apex = y.argmax(axis=1)
+    apex_height = y[rows, apex]
+    has_peak = apex_height > 0
+
+    # candidate boundary scans: below threshold or local minimum of the smoothed trace
+    previous = np.concatenate([y[:, :1], y[:, :-1]], axis=1)
+    following = np.concatenate([y[:, 1:], y[:, -1:]], axis=1)
+    local_min = ((y < previous) & (y <= following)) | ((y <= previous) & (y < following))
+    stop = (y <= boundary_fraction * apex_height[:, None]) | local_min
+    left = np.where(stop & (scans < apex[:, None]), scans, 0).max(axis=1)
+    right = np.where(stop & (scans > apex[:, None]), scans, scans[-1]).min(axis=1)
+
+    # the apex is the raw maximum inside the boundaries, on the flat top of a
+    # smoothed narrow peak the smoothed maximum can be off by a few scans
+    inside_peak = (scans >= left[:, None]) & (scans <= right[:, None])
+    apex = np.where(inside_peak, raw, -np.inf).argmax(axis=1)
+
+    # trapezoid integration of the raw signal over segments inside the boundaries
+    inside = (scans[:-1] >= left[:, None]) & (scans[1:] <= right[:, None])
+    segments = np.diff(times) * (raw[:, :-1] + raw[:, 1:]) / 2
+    area = np.where(inside, segments, 0).sum(axis=1)
+
+    # full width at half maximum from interpolated half height crossings of the
+    # raw trace, smoothing widens the peak and is only used to locate the apex
+    half = raw[rows, apex] / 2
+    below = raw < half[:, None]
+    left_half = np.where(below & (scans < apex[:, None]), scans, -1).max(axis=1)
+    right_half = np.where(below & (scans > apex[:, None]), scans, scans.size).min(axis=1)
+    left_rt = np.where(
+        left_half >= 0,
+        _interpolate_crossing(times, raw, half, np.maximum(left_half, 0), np.minimum(np.maximum(left_half, 0) + 1, scans[-1])),
+        times[0],
+    )
+    right_rt = np.where(
+        right_half < scans.size,
+        _interpolate_crossing(times, raw, half, np.maximum(np.minimum(right_half, scans[-1]) - 1, 0), np.minimum(right_half, scans[-1])),
+        times[-1],
+    )
+
+    features = np.column_stack(
+        [times[apex], raw[rows, apex], times[left], times[right], right_rt - left_rt, area]
+    )
+    features[~has_peak] = 0
+    return pd.DataFrame(features, columns=columns)
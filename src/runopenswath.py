@@ -1,43 +1,130 @@
-import streamlit as st
 import subprocess
+import shutil
 from pathlib import Path
 import pandas as pd
+from .workspace import create_job_directory, publish_file
+from .admission import estimate_resources, run_admitted
+from .swathsplit import get_split_openswath_input
 
 
-def run_openswath(mzML_files, rt_window, library, windows, out_dir):
-    Path(out_dir).mkdir(exist_ok=True)
+def build_openswath_command(file, library, windows, out_tsv, additional=[], out_chrom="", read_options="normal", temp_dir="", threads=1):
+    """
+    Build the command line for an OpenSwathWorkflow run.
+
+    Args:
+        file (str | list): Input file (mzML or sqMass) or pre-split files (see swathsplit.py).
+        library (str): Transition library.
+        windows (str): SWATH window file.
+        out_tsv (str): TSV output file.
+        additional (list): Additional OpenSwathWorkflow arguments.
+        out_chrom (str): Optional output file for the extracted chromatograms.
+        read_options (str): OpenSwathWorkflow -readOptions value.
+        temp_dir (str): Directory for cached data, required for the cache read options.
+        threads (int): Number of OpenSwathWorkflow threads.
+
+    Returns:
+        list: The command as a list of arguments.
+    """
+    command = [
+        "OpenSwathWorkflow",
+        "-in",
+        *([file] if isinstance(file, str) else file),
+        "-out_tsv",
+        out_tsv,
+        "-tr",
+        library,
+        "-swath_windows_file",
+        windows,
+        "-readOptions",
+        read_options,
+        "-threads",
+        str(threads),
+    ]
+    if temp_dir:
+        command += ["-tempDirectory", temp_dir]
+    if out_chrom:
+        command += ["-out_chrom", out_chrom]
+    return command + list(additional) + ["-force"]
+
+
+def get_openswath_input(mzML_file, library, windows, out_dir, out_root="swath-split"):
+    """
+    Input files and SWATH window file for an OpenSwathWorkflow run.
+
+    If the mzML file was split with the same windows (see swathsplit.py) only
+    the MS1 file and the window files with library precursors are used.
+
+    Args:
+        mzML_file (str): Path to the raw mzML file.
+        library (str): Transition library, precursors are read from tsv libraries only.
+        windows (str): SWATH window file.
+        out_dir (str): Directory for the window file of the selected windows.
+        out_root (str): Root directory for all split files.
+
+    Returns:
+        tuple: (input file or list of split files, SWATH window file)
+    """
+    if Path(library).suffix == ".tsv":
+        precursor_mzs = pd.read_csv(library, sep="\t", usecols=["PrecursorMz"])["PrecursorMz"]
+        split = get_split_openswath_input(mzML_file, windows, precursor_mzs, out_dir, out_root)
+        if split is not None:
+            return split
+    return mzML_file, windows
+
+
+def run_openswath(mzML_files, rt_window, library, windows, out_dir, threads=1, on_wait=None):
+    """
+    Run OpenSwathWorkflow for each mzML file and publish the results to the output directory.
+
+    Files split with the same windows only read the windows of the library precursors (see get_openswath_input).
+
+    Args:
+        mzML_files (list): Paths to the mzML files.
+        rt_window (str): RT extraction window in seconds.
+        library (str): Transition library.
+        windows (str): SWATH window file.
+        out_dir (str): Output directory for the result tsv files.
+        threads (int): Number of OpenSwathWorkflow threads per run.
+        on_wait (callable, optional): Called if a run has to wait for memory (see admission.py).
+
+    Returns:
+        pd.DataFrame: One row per file with "file", "out_tsv", "success" and "identifications".
+    """
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    runs = []
     for file in mzML_files:
         out_file = Path(out_dir, f"{Path(file).stem}_{Path(library).stem}_{rt_window}s.tsv")
+        # write into a private job directory, the result is published with a rename
+        job_dir = create_job_directory(out_dir)
+        tmp_file = Path(job_dir, out_file.name)
+        input_files, input_windows = get_openswath_input(file, library, windows, job_dir)
         # Set up command for OpenSwathWorkflow
-        command = [
-            "OpenSwathWorkflow",
-            "-in",
-            file,
-            "-out_tsv",
-            str(out_file),
-            "-tr",
+        command = build_openswath_command(
+            input_files,
             library,
-            "-swath_windows_file",
-            windows,
-            "-force",
-            "-rt_extraction_window",
-            rt_window,
-            # "-Scoring:TransitionGroupPicker:min_peak_width",
-            # str(30.0),
-        ]
+            input_windows,
+            str(tmp_file),
+            [
+                "-rt_extraction_window",
+                rt_window,
+                # "-Scoring:TransitionGroupPicker:min_peak_width",
+                # str(30.0),
+            ],
+            threads=threads,
+        )
 
         print("Running command:", subprocess.list2cmdline(command))
 
-        result = subprocess.run(command, capture_output=True, text=True)
+        # waits while other jobs use the memory this run needs
+        estimate = estimate_resources("openswath", file, library, threads)
+        result = run_admitted(command, estimate, "openswath", on_wait=on_wait)
 
         print(result.stdout)
 
-        if out_file.exists():
-            st.success("OpenSWATH run was successful.")
-            df = pd.read_csv(out_file, sep="\t")
-            if df.empty:
-                st.warning("Results are empty, no metabolites detected. This run will not be shown in results.")
-        else:
-            st.error(
-                "Something went wrong during OpenSWATH run, check your inputs and terminal output."
-            )
+        if tmp_file.exists():
+            publish_file(tmp_file, out_file)
+        shutil.rmtree(job_dir, ignore_errors=True)
+        success = result.returncode == 0 and out_file.exists()
+        runs.append({"file": str(file), "out_tsv": str(out_file), "success": success,
+                     "identifications": len(pd.read_csv(out_file, sep="\t")) if success else 0})
+    return pd.DataFrame(runs, columns=["file", "out_tsv", "success", "identifications"])
@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+
+
+def bin_spectra(mzs_list, intys_list, bin_width=0.01):
+    """
+    Bin spectra into sparse, normalized vectors.
+
+    Intensities are square root scaled, peaks falling into the same m/z bin are
+    summed and each spectrum is scaled to unit length, so the dot product of two
+    vectors is their cosine similarity.
+
+    Args:
+        mzs_list (list): m/z arrays, one per spectrum.
+        intys_list (list): Intensity arrays, one per spectrum.
+        bin_width (float): m/z bin width in Da.
+
+    Returns:
+        tuple: Arrays (spectrum row, bin, value) of all non-zero entries, sorted by bin.
+    """
+    sizes = [len(mzs) for mzs in mzs_list]
+    if not sum(sizes):
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([])
+    rows = np.repeat(np.arange(len(sizes)), sizes)
+    bins = np.floor(np.concatenate(mzs_list) / bin_width).astype(np.int64)
+    values = np.sqrt(np.clip(np.concatenate(intys_list).astype(float), 0, None))
+
+    # sum peaks of a spectrum within the same bin
+    n_bins = bins.max() + 1
+    keys, inverse = np.unique(rows * n_bins + bins, return_inverse=True)
+    values = np.bincount(inverse, values)
+    rows, bins = keys // n_bins, keys % n_bins
+
+    norms = np.sqrt(np.bincount(rows, values ** 2, minlength=len(sizes)))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = np.where(norms[rows] > 0, values / norms[rows], 0)
+
+    order = np.argsort(bins, kind="stable")
+    return rows[order], bins[order], values[order]
+
+
+def build_library_index(library, bin_width=0.01):
+    """
+    Bin the transitions of an assay library into one sparse vector per compound precursor.
+
+    Args:
+        library (str): Path to the assay library (tsv) with "CompoundName", "PrecursorMz",
+                       "ProductMz" and "LibraryIntensity" columns.
+        bin_width (float): m/z bin width in Da.
+
+    Returns:
+        dict: "compounds" (pd.DataFrame with "CompoundName" and "PrecursorMz"), "rows", "bins"
+              and "values" (sorted by bin, see bin_spectra) and "bin_width".
+    """
+    df = pd.read_csv(library, sep="\t")
+    groups = df.groupby(["CompoundName", "PrecursorMz"], sort=True)
+    compounds = pd.DataFrame(list(groups.groups.keys()), columns=["CompoundName", "PrecursorMz"])
+    rows, bins, values = bin_spectra(
+        [g["ProductMz"].to_numpy() for _, g in groups],
+        [g["LibraryIntensity"].to_numpy() for _, g in groups],
+        bin_width,
+    )
+    return {"compounds": compounds, "rows": rows, "bins": bins, "values": values, "bin_width": bin_width}
+
+
+def search_spectra(mzs_list, intys_list, precursor_mzs, library_index, precursor_tolerance=0.05, top_n=3, chunk_size=2000):
+    """
+    Score query spectra against all library compounds within the precursor tolerance.
+
+    The cosine similarity is the sparse product of binned query and library
+    vectors: matching bins are joined with binary searches on the sorted
+    library bins and the products are summed per (query, compound) pair.
+
+    Args:
+        mzs_list (list): m/z arrays of the query spectra.
+        intys_list (list): Intensity arrays of the query spectra.
+        precursor_mzs (list): Precursor m/z of each query spectrum.
+        library_index (dict): Binned library (see build_library_index).
+        precursor_tolerance (float): Maximum precursor m/z difference in Da, use
+                                     half the isolation window width for SWATH spectra.
+        top_n (int): Number of hits reported per query spectrum.
+        chunk_size (int): Number of query spectra scored at once.
+
+    Returns:
+        pd.DataFrame: Columns "spectrum", "rank", "CompoundName", "PrecursorMz", "score"
+                      and "matched peaks", sorted by spectrum and rank.
+    """
+    compounds = library_index["compounds"]
+    lib_rows, lib_bins, lib_values = library_index["rows"], library_index["bins"], library_index["values"]
+    lib_prec = compounds["PrecursorMz"].to_numpy()
+    precursor_mzs = np.asarray(precursor_mzs, dtype=float)
+    n_lib = len(compounds)
+
+    hits = []
+    for offset in range(0, len(mzs_list), chunk_size):
+        q_rows, q_bins, q_values = bin_spectra(mzs_list[offset:offset + chunk_size],
+                                               intys_list[offset:offset + chunk_size],
+                                               library_index["bin_width"])
+        # all (query entry, library entry) pairs sharing a bin
+        starts = np.searchsorted(lib_bins, q_bins, side="left")
+        counts = np.searchsorted(lib_bins, q_bins, side="right") - starts
+        q_entry = np.repeat(np.arange(q_bins.size), counts)
+        lib_entry = np.repeat(starts, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        query, compound = q_rows[q_entry], lib_rows[lib_entry]
+
+        keep = np.abs(precursor_mzs[offset + query] - lib_prec[compound]) <= precursor_tolerance
+        products = q_values[q_entry[keep]] * lib_values[lib_entry[keep]]
+        pairs, inverse = np.unique(query[keep] * n_lib + compound[keep], return_inverse=True)
+        scores = np.bincount(inverse, products)
+        matched = np.bincount(inverse)
+        query, compound = pairs // n_lib, pairs % n_lib
+
+        # top n per query spectrum
+        order = np.lexsort((-scores, query))
+        query, compound, scores, matched = query[order], compound[order], scores[order], matched[order]
+        first = np.searchsorted(query, query, side="left")
+        rank = np.arange(query.size) - first + 1
+        best = rank <= top_n
+        hits.append(pd.DataFrame({
+            "spectrum": query[best] + offset,
+            "rank": rank[best],
+            "CompoundName": compounds["CompoundName"].to_numpy()[compound[best]],
+            "PrecursorMz": lib_prec[compound[best]],
+            "score": scores[best],
+            "matched peaks": matched[best],
+        }))
+
+    if not hits:
+        return pd.DataFrame(columns=["spectrum", "rank", "CompoundName", "PrecursorMz", "score", "matched peaks"])
+    return pd.concat(hits, ignore_index=True)
@@ -0,0 +1,191 @@
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from pyopenms import *
+
+from .workspace import file_fingerprint, create_job_directory, publish_directory
+from .swathwindows import read_swath_windows
+
+
+def get_split_directory(mzML_file, out_root="swath-split"):
+    """
+    Directory where the split files of an mzML file are stored.
+
+    Args:
+        mzML_file (str): Path to the raw mzML file.
+        out_root (str): Root directory for all split files.
+
+    Returns:
+        Path: Directory keyed by file name and fingerprint of the raw file.
+    """
+    return Path(out_root, f"{Path(mzML_file).stem}-{file_fingerprint(mzML_file)}")
+
+
+def get_split_index(mzML_file, out_root="swath-split"):
+    """
+    Index of the split files for an mzML file.
+
+    Args:
+        mzML_file (str): Path to the raw mzML file.
+        out_root (str): Root directory for all split files.
+
+    Returns:
+        pd.DataFrame: Columns "window", "start", "stop", "file" and "spectra" (window -1 is MS1,
+                      window -2 counts the MS2 spectra in no window),
+                      empty if the file has not been split yet.
+    """
+    path = Path(get_split_directory(mzML_file, out_root), "index.tsv")
+    if not path.exists():
+        return pd.DataFrame()
+    return pd.read_csv(path, sep="\t")
+
+
+def split_swath_file(mzML_file, windows_file, out_root="swath-split", max_workers=None):
+    """
+    Split an mzML file with SWATH data into one MS1 file and one file per SWATH window.
+
+    MS2 spectra are assigned to the first window containing their precursor m/z.
+    The raw file is decoded once, the window files are written in parallel and
+    an index.tsv describing all files is written last.
+
+    Args:
+        mzML_file (str): Path to the raw mzML file.
+        windows_file (str): SWATH window file.
+        out_root (str): Root directory for all split files.
+        max_workers (int, optional): Number of windows written concurrently.
+
+    Returns:
+        pd.DataFrame: The index of the split files.
+    """
+    # write into a private directory, published with a rename when complete
+    split_dir = get_split_directory(mzML_file, out_root)
+    out_dir = create_job_directory(out_root)
+    windows = read_swath_windows(windows_file)
+
+    exp = MSExperiment()
+    MzMLFile().load(str(mzML_file), exp)
+
+    ms1 = []
+    per_window = [[] for _ in range(len(windows))]
+    unassigned = 0
+    for spec in exp:
+        if spec.getMSLevel() == 1:
+            ms1.append(spec)
+            continue
+        if not spec.getPrecursors():
+            unassigned += 1
+            continue
+        mz = spec.getPrecursors()[0].getMZ()
+        match = windows.index[(windows["start"] <= mz) & (mz < windows["stop"])]
+        if len(match):
+            per_window[match[0]].append(spec)
+        else:
+            unassigned += 1
+    if unassigned:
+        print(f"{Path(mzML_file).name}: {unassigned} MS2 spectra are in no window of {Path(windows_file).name} and were not stored.")
+
+    def store(name, spectra):
+        part = MSExperiment()
+        part.setExperimentalSettings(exp.getExperimentalSettings())
+        for spec in spectra:
+            part.addSpectrum(spec)
+        MzMLFile().store(str(Path(out_dir, name)), part)
+        return len(spectra)
+
+    names = ["ms1.mzML"] + [f"window{i}.mzML" for i in range(len(windows))]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        counts = list(executor.map(store, names, [ms1] + per_window))
+
+    # window -2 counts the MS2 spectra without a window, they are not stored
+    index = pd.DataFrame({
+        "window": [-1] + list(range(len(windows))) + [-2],
+        "start": [0.0] + windows["start"].tolist() + [0.0],
+        "stop": [0.0] + windows["stop"].tolist() + [0.0],
+        "file": names + [""],
+        "spectra": counts + [unassigned],
+    })
+    index.to_csv(Path(out_dir, "index.tsv"), sep="\t", index=False)
+    publish_directory(out_dir, split_dir)
+    return index
+
+
+def _select_windows(index, precursor_mzs=None):
+    # rows of the SWATH windows containing any of the precursors (all windows if None)
+    selected = index[index["window"] >= 0]
+    if precursor_mzs is not None:
+        mzs = pd.Series(precursor_mzs, dtype=float)
+        selected = selected[[((start <= mzs) & (mzs < stop)).any() for start, stop in zip(selected["start"], selected["stop"])]]
+    return selected
+
+
+def get_split_openswath_input(mzML_file, windows_file, precursor_mzs, out_dir, out_root="swath-split"):
+    """
+    Split files and SWATH window file for an OpenSwathWorkflow run on the windows of the given precursors.
+
+    OpenSwathWorkflow accepts pre-split files as input, the window file has to
+    list exactly the windows of these files in the same order and is written to out_dir.
+
+    Args:
+        mzML_file (str): Path to the raw mzML file.
+        windows_file (str): SWATH window file of the run, the split files are only used if they were split with it.
+        precursor_mzs (list): Precursor m/z values of the library.
+        out_dir (str): Directory for the window file.
+        out_root (str): Root directory for all split files.
+
+    Returns:
+        tuple: (list of input files, SWATH window file) or None if the raw file has to be used.
+    """
+    index = get_split_index(mzML_file, out_root)
+    if index.empty:
+        return None
+    split = index[index["window"] >= 0]
+    windows = read_swath_windows(windows_file)
+    if len(windows) != len(split) or not np.allclose(windows.to_numpy(), split[["start", "stop"]].to_numpy()):
+        return None
+    selected = _select_windows(index, precursor_mzs)
+    selected = selected[selected["spectra"] > 0]
+    if selected.empty:
+        return None
+    split_dir = get_split_directory(mzML_file, out_root)
+    files = [str(Path(split_dir, name)) for name in selected["file"]]
+    if index.loc[index["window"] == -1, "spectra"].sum() > 0:
+        files.insert(0, str(Path(split_dir, "ms1.mzML")))
+    path = Path(out_dir, f"{Path(mzML_file).stem}-windows.tsv")
+    selected[["start", "stop"]].to_csv(path, sep="\t", index=False)
+    return files, str(path)
+
+
+def load_split_experiment(mzML_file, precursor_mzs=None, ms1=True, out_root="swath-split", max_workers=None):
+    """
+    Load only the parts of a split mzML file which are needed for the given precursors.
+
+    Args:
+        mzML_file (str): Path to the raw mzML file.
+        precursor_mzs (list, optional): Precursor m/z values, window files containing them are loaded.
+        ms1 (bool): Load the MS1 spectra.
+        out_root (str): Root directory for all split files.
+        max_workers (int, optional): Number of files loaded concurrently.
+
+    Returns:
+        MSExperiment: The selected spectra sorted by RT, None if the file has not been split.
+    """
+    index = get_split_index(mzML_file, out_root)
+    if index.empty:
+        return None
+    files = _select_windows(index, precursor_mzs)["file"].tolist()
+    if ms1:
+        files.insert(0, "ms1.mzML")
+
+    def load(name):
+        part = MSExperiment()
+        MzMLFile().load(str(Path(get_split_directory(mzML_file, out_root), name)), part)
+        return part
+
+    exp = MSExperiment()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for part in executor.map(load, files):
+            for spec in part:
+                exp.addSpectrum(spec)
+    exp.sortSpectra(False)
+    return exp
@@ -0,0 +1,211 @@
+import re
+import uuid
+from pathlib import Path
+import pandas as pd
+
+from .workspace import publish_file
+
+# Spectrum metadata is read directly from the mzML text: with the index of an
+# indexed mzML file only the first few kB of each spectrum (up to the binary
+# data arrays) are read, peak arrays are never decoded.
+
+_CV_PARAM = re.compile(rb"<cvParam\s[^>]*>")
+_ATTRIBUTE = re.compile(rb'(\w+)="([^"]*)"')
+_SPECTRUM_OFFSET = re.compile(rb"<offset[^>]*>(\d+)</offset>")
+_MINUTE = b"UO:0000031"
+
+
+def _parse_spectrum_header(text):
+    header = {"mslevel": 0, "RT": 0.0, "precursormz": 0.0, "lower": 0.0, "upper": 0.0}
+    target = lower_offset = upper_offset = None
+    for tag in _CV_PARAM.findall(text):
+        attributes = dict(_ATTRIBUTE.findall(tag))
+        accession, value = attributes.get(b"accession"), attributes.get(b"value", b"")
+        if accession == b"MS:1000511":  # ms level
+            header["mslevel"] = int(value)
+        elif accession == b"MS:1000016":  # scan start time
+            header["RT"] = float(value) * (60 if attributes.get(b"unitAccession") == _MINUTE else 1)
+        elif accession == b"MS:1000827":  # isolation window target m/z
+            target = float(value)
+        elif accession == b"MS:1000828":  # isolation window lower offset
+            lower_offset = float(value)
+        elif accession == b"MS:1000829":  # isolation window upper offset
+            upper_offset = float(value)
+        elif accession == b"MS:1000744":  # selected ion m/z
+            header["precursormz"] = float(value)
+    if target is not None:
+        header["precursormz"] = header["precursormz"] or target
+        if lower_offset is not None and upper_offset is not None:
+            header["lower"], header["upper"] = target - lower_offset, target + upper_offset
+    return header
+
+
+def _get_spectrum_offsets(f):
+    # <indexListOffset> is at the very end of an indexed mzML file
+    f.seek(0, 2)
+    size = f.tell()
+    f.seek(max(0, size - 1024))
+    match = re.search(rb"<indexListOffset>(\d+)</indexListOffset>", f.read())
+    if not match:
+        return None
+    f.seek(int(match.group(1)))
+    index = f.read()
+    start = index.find(b'<index name="spectrum"')
+    if start < 0:
+        return None
+    end = index.find(b"</index>", start)
+    return [int(offset) for offset in _SPECTRUM_OFFSET.findall(index, start, end)]
+
+
+def _iter_header_texts(mzML_file):
+    with open(mzML_file, "rb") as f:
+        offsets = _get_spectrum_offsets(f)
+        if offsets is not None:
+            for offset in offsets:
+                f.seek(offset)
+                text = f.read(4096)
+                while b"<binaryDataArrayList" not in text and b"</spectrum>" not in text:
+                    chunk = f.read(4096)
+                    if not chunk:
+                        break
+                    text += chunk
+                yield re.split(rb"<binaryDataArrayList|</spectrum>", text, maxsplit=1)[0]
+            return
+
+        # not indexed: stream the file, skipping the lines with binary data
+        f.seek(0)
+        text, in_spectrum = b"", False
+        for line in f:
+            if b"<spectrum " in line:
+                text, in_spectrum = line, True
+            elif in_spectrum:
+                if b"<binaryDataArrayList" in line:
+                    in_spectrum = False
+                    yield text
+                else:
+                    text += line
+
+
+def iter_spectrum_headers(mzML_file):
+    """
+    Read the metadata of all spectra in an mzML file without decoding peak arrays.
+
+    Args:
+        mzML_file (str): Path to the mzML file (indexed mzML is read through its offset index).
+
+    Yields:
+        dict: "mslevel", "RT" (seconds), "precursormz" and the isolation window "lower" and "upper" m/z
+              (0 for MS1 spectra), in file order.
+    """
+    for text in _iter_header_texts(mzML_file):
+        yield _parse_spectrum_header(text)
+
+
+def read_spectrum_headers(mzML_file):
+    """
+    Metadata of all spectra in an mzML file (see iter_spectrum_headers).
+
+    Args:
+        mzML_file (str): Path to the mzML file.
+
+    Returns:
+        pd.DataFrame: One row per spectrum with "mslevel", "RT", "precursormz", "lower" and "upper".
+    """
+    return pd.DataFrame(list(iter_spectrum_headers(mzML_file)), columns=["mslevel", "RT", "precursormz", "lower", "upper"])
+
+
+def read_swath_windows(windows_file):
+    """
+    Read a SWATH window file.
+
+    Args:
+        windows_file (str): Tab separated file with a header and start, stop m/z columns.
+
+    Returns:
+        pd.DataFrame: Columns "start" and "stop", one row per window.
+    """
+    df = pd.read_csv(windows_file, sep="\t")
+    df = df.iloc[:, :2]
+    df.columns = ["start", "stop"]
+    return df.astype(float)
+
+
+def derive_swath_windows(mzML_file, cycles=3, decimals=4):
+    """
+    Derive the SWATH windows of an acquisition from the isolation windows of its MS2 spectra.
+
+    Only the headers of the first cycles are read, the scan stops once the
+    first window has been acquired the given number of times.
+
+    Args:
+        mzML_file (str): Path to the mzML file.
+        cycles (int): Number of SWATH cycles to read.
+        decimals (int): Window limits are rounded to this number of decimals.
+
+    Returns:
+        pd.DataFrame: Columns "start" and "stop", one row per window sorted by start,
+                      empty if the file has no MS2 spectra with isolation windows.
+    """
+    counts = {}
+    for header in iter_spectrum_headers(mzML_file):
+        if header["mslevel"] != 2 or header["upper"] <= header["lower"]:
+            continue
+        window = (round(header["lower"], decimals), round(header["upper"], decimals))
+        counts[window] = counts.get(window, 0) + 1
+        if counts[window] > cycles:
+            break
+    return pd.DataFrame(sorted(counts), columns=["start", "stop"], dtype=float)
+
+
+def get_swath_windows(mzML_file, cycles=3):
+    """
+    SWATH windows of an mzML file, cached in a window file next to it (<name>.windows.tsv).
+
+    The cached file is derived again if the mzML file is newer. If the directory
+    is not writable the windows are derived without caching.
+
+    Args:
+        mzML_file (str): Path to the mzML file.
+        cycles (int): Number of SWATH cycles read (see derive_swath_windows).
+
+    Returns:
+        tuple: (pd.DataFrame with "start" and "stop", path to the window file or None if not cached)
+    """
+    path = Path(mzML_file).with_suffix(".windows.tsv")
+    if path.exists() and path.stat().st_mtime >= Path(mzML_file).stat().st_mtime:
+        return read_swath_windows(path), path
+    windows = derive_swath_windows(mzML_file, cycles)
+    try:
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+        windows.to_csv(tmp, sep="\t", index=False)
+        publish_file(tmp, path)
+    except OSError:
+        return windows, None
+    return windows, path
+
+
+def verify_swath_windows(windows_file, mzML_file, tolerance=0.5):
+    """
+    Check that the windows of a SWATH window file were acquired in an mzML file.
+
+    A window file may contain a subset of the acquired windows and may trim
+    their overlaps, each of its windows has to lie within one acquired window.
+
+    Args:
+        windows_file (str): SWATH window file.
+        mzML_file (str): Path to the mzML file.
+        tolerance (float): Allowed m/z by which a window may exceed the acquired window.
+
+    Returns:
+        list: Problems found as messages, empty if the window file matches or the
+              mzML file has no isolation windows to compare with (see get_swath_windows).
+    """
+    acquired, _ = get_swath_windows(mzML_file)
+    if acquired.empty:
+        return []
+    problems = []
+    for start, stop in read_swath_windows(windows_file).itertuples(index=False):
+        inside = (acquired["start"] - tolerance <= start) & (stop <= acquired["stop"] + tolerance)
+        if not inside.any():
+            problems.append(f"Window {start:g}-{stop:g} was not acquired in {Path(mzML_file).name}.")
+    return problems
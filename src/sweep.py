@@ -0,0 +1,133 @@
+import subprocess
+import itertools
+import os
+import shutil
+import uuid
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+
+from .workspace import file_fingerprint
+from .runopenswath import build_openswath_command, get_openswath_input
+from .admission import controller, estimate_resources, run_admitted
+
+
+def prepare_cached_input(mzML_file, cache_dir="openswath-cache"):
+    """
+    Convert a raw mzML file once into sqMass for repeated OpenSwathWorkflow runs.
+
+    The converted file is keyed by the fingerprint of the raw file and reused
+    as long as the raw file does not change.
+
+    Args:
+        mzML_file (str): Path to the raw mzML file.
+        cache_dir (str): Persistent directory for converted files.
+
+    Returns:
+        str: Path to the converted sqMass file.
+    """
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    cached = Path(cache_dir, f"{Path(mzML_file).stem}-{file_fingerprint(mzML_file)}.sqMass")
+    if not cached.exists():
+        # convert to a temporary name first, concurrent sweeps never see partial files
+        tmp = cached.with_suffix(f".{uuid.uuid4().hex}.tmp.sqMass")
+        command = ["FileConverter", "-in", str(mzML_file), "-out", str(tmp), "-force"]
+        print("Running command:", subprocess.list2cmdline(command))
+        subprocess.run(command, capture_output=True, text=True)
+        if not tmp.exists():
+            raise RuntimeError(f"Could not convert {mzML_file} to sqMass.")
+        tmp.replace(cached)
+    return str(cached)
+
+
+def _prepare_input(mzML_file, library, windows, out_dir, cache_dir, read_options):
+    # split files of the library windows, else the converted file, else the raw mzML file.
+    # -readOptions only applies to mzML input, sqMass is always read from disk
+    input_files, input_windows = get_openswath_input(mzML_file, library, windows, out_dir)
+    if input_files != mzML_file:
+        return input_files, input_windows, "normal"
+    try:
+        return prepare_cached_input(mzML_file, cache_dir), windows, "normal"
+    except RuntimeError as e:
+        print(f"{e} Running OpenSWATH on the mzML file.")
+        return mzML_file, windows, read_options
+
+
+def parse_parameter_sets(text):
+    """
+    Split text with OpenSwathWorkflow arguments into parameter sets.
+
+    Parameter sets are separated by lines containing only "---", arguments
+    within a set are separated by white space.
+
+    Args:
+        text (str): Parameter sets as entered by the user.
+
+    Returns:
+        list: List of argument lists, one per parameter set.
+    """
+    sets = [block.split() for block in text.split("\n---")]
+    return [s for s in sets if s]
+
+
+def run_parameter_sweep(mzML_files, library, windows, parameter_sets, out_dir,
+                        cache_dir="openswath-cache", read_options="cacheWorkingInMemory",
+                        max_workers=None, progress=None):
+    """
+    Run OpenSwathWorkflow for every combination of mzML file and parameter set in parallel.
+
+    Files split with the same windows run on the split files of the library
+    windows (see get_openswath_input). Other raw files are converted only once
+    (see prepare_cached_input), all parameter sets of that file run on the
+    converted data (or on the raw file with read_options if the conversion fails).
+    Each run has a private -tempDirectory which is removed afterwards.
+
+    Args:
+        mzML_files (list): Paths to the raw mzML files.
+        library (str): Transition library.
+        windows (str): SWATH window file.
+        parameter_sets (list): List of additional argument lists.
+        out_dir (str): Output directory for the result tsv files.
+        cache_dir (str): Persistent directory for the converted files, shared by all users.
+        read_options (str): OpenSwathWorkflow -readOptions value for raw mzML input,
+                            sqMass input ignores it.
+        max_workers (int, optional): Number of concurrent OpenSwathWorkflow runs, defaults to
+                                     as many as fit the memory budget (see admission.py).
+        progress (callable, optional): Called with (n_done, n_total, run) after each finished run.
+
+    Returns:
+        pd.DataFrame: One row per run with "file", "parameter set", "parameters", "out_tsv" and "success".
+    """
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max_workers or max(1, (os.cpu_count() or 1) // 2)) as executor:
+        inputs = dict(zip(mzML_files, executor.map(
+            lambda f: _prepare_input(f, library, windows, out_dir, cache_dir, read_options), mzML_files)))
+    estimates = {file: estimate_resources("openswath", file, library) for file in mzML_files}
+    if max_workers is None:
+        max_workers = controller.max_parallel(max(estimates.values(), key=lambda e: e["memory_mb"]))
+
+    def run(file, i, parameters):
+        stem = f"{Path(file).stem}_set{i}"
+        out_tsv = Path(out_dir, stem + ".tsv")
+        # OpenSWATH cache files are private to each run
+        temp_dir = Path(out_dir, ".tmp", stem)
+        temp_dir.mkdir(parents=True, exist_ok=True)
+        input_files, input_windows, input_read_options = inputs[file]
+        command = build_openswath_command(input_files, library, input_windows, str(out_tsv), parameters,
+                                          read_options=input_read_options, temp_dir=str(temp_dir))
+        print("Running command:", subprocess.list2cmdline(command))
+        run_admitted(command, estimates[file], "openswath")
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        return {"file": Path(file).stem, "parameter set": i, "parameters": " ".join(parameters),
+                "out_tsv": str(out_tsv), "success": out_tsv.exists()}
+
+    runs = list(itertools.product(mzML_files, enumerate(parameter_sets)))
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run, file, i, parameters) for file, (i, parameters) in runs]
+        for n, future in enumerate(as_completed(futures), start=1):
+            results.append(future.result())
+            if progress:
+                progress(n, len(futures), results[-1])
+
+    return pd.DataFrame(results).sort_values(["file", "parameter set"]).reset_index(drop=True)
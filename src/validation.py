@@ -0,0 +1,48 @@
+from pathlib import Path
+import pandas as pd
+
+
+def summarize_openswath_result(tsv, name=""):
+    """
+    Peak area per compound from an OpenSwathWorkflow result file.
+
+    The area of a transition group is its largest "aggr_prec_Peak_Area", the area
+    of a compound the mean over its transition groups (adducts).
+
+    Args:
+        tsv (str): OpenSwathWorkflow result file (-out_tsv).
+        name (str): Column name, defaults to the file stem.
+
+    Returns:
+        pd.DataFrame: Index "CompoundName" with one area column, empty if nothing was identified.
+    """
+    df = pd.read_csv(tsv, sep="\t")
+    if df.empty:
+        return pd.DataFrame()
+    df = df.groupby("peptide_group_label")[["aggr_prec_Peak_Area"]].max()
+    df["CompoundName"] = [x.split("_")[0] for x in df.index.tolist()]
+    df = df.groupby("CompoundName")[["aggr_prec_Peak_Area"]].mean()
+    return df.rename(columns={"aggr_prec_Peak_Area": name or Path(tsv).stem})
+
+
+def build_validation_summary(openswath_tsvs, eic_areas=None):
+    """
+    Combine OpenSWATH and EIC areas of many samples into one table.
+
+    Args:
+        openswath_tsvs (list): OpenSwathWorkflow result files, one per sample.
+        eic_areas (pd.DataFrame, optional): EIC areas (compounds x samples), see get_eic_area_matrix.
+
+    Returns:
+        pd.DataFrame: Index "CompoundName", one column per sample and method
+                      (EIC columns end with " EIC"), empty if there are no results.
+    """
+    dfs = [summarize_openswath_result(tsv) for tsv in openswath_tsvs]
+    dfs = [df for df in dfs if not df.empty]
+    if eic_areas is not None and not eic_areas.empty:
+        eic_areas = eic_areas.rename(columns=lambda c: f"{c} EIC")
+        eic_areas.index.name = "CompoundName"
+        dfs.append(eic_areas)
+    if not dfs:
+        return pd.DataFrame()
+    return pd.concat(dfs, axis=1).sort_index()
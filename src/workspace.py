@@ -0,0 +1,95 @@
+import hashlib
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+# Each user session works in its own workspace directory, each job writes into
+# a private job directory inside the workspace and publishes its results with
+# a rename once complete. Shared caches (openswath-cache, library-cache,
+# mzML-index, swath-split) are only ever written through atomic renames too.
+
+
+def file_fingerprint(path):
+    """
+    Short hash identifying a file by its resolved path, size and modification time.
+
+    Args:
+        path (Path): Path to the file.
+
+    Returns:
+        str: A 16 character hex digest, changes whenever the file is replaced or modified.
+    """
+    path = Path(path).resolve()
+    stat = path.stat()
+    key = f"{path}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def create_job_directory(workspace):
+    """
+    Create a private directory for a single job.
+
+    Args:
+        workspace (Path): The workspace directory.
+
+    Returns:
+        Path: A new, empty job directory inside the workspace.
+    """
+    path = Path(workspace, "jobs", uuid.uuid4().hex)
+    path.mkdir(parents=True)
+    return path
+
+
+def publish_file(path, destination):
+    """
+    Atomically move a finished file to its destination, replacing an older version.
+
+    Args:
+        path (Path): The finished file (on the same file system as the destination).
+        destination (Path): The destination path.
+
+    Returns:
+        Path: The destination path.
+    """
+    Path(destination).parent.mkdir(parents=True, exist_ok=True)
+    os.replace(path, destination)
+    return Path(destination)
+
+
+def publish_directory(path, destination, attempts=10):
+    """
+    Move a finished directory to its destination, replacing an older version.
+
+    The old version is renamed away first and removed afterwards, readers see
+    the complete old or the complete new directory or, for a short moment in
+    between, no directory (the split and index readers then fall back to the raw
+    file). If a concurrent publisher puts its directory in place in that moment
+    the rename is retried, the last publisher wins.
+
+    Args:
+        path (Path): The finished directory (on the same file system as the destination).
+        destination (Path): The destination path.
+        attempts (int): Number of tries when concurrent publishers collide.
+
+    Returns:
+        Path: The destination path.
+    """
+    destination = Path(destination)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    for attempt in range(attempts):
+        old = destination.with_name(f".{destination.name}-{uuid.uuid4().hex[:8]}")
+        try:
+            destination.rename(old)
+        except FileNotFoundError:
+            # no old version, or another publisher just moved it away
+            pass
+        try:
+            Path(path).rename(destination)
+            return destination
+        except OSError:
+            # another publisher renamed its directory into place first
+            if attempt == attempts - 1:
+                raise
+        finally:
+            shutil.rmtree(old, ignore_errors=True)
@@ -0,0 +1,93 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("pyopenms")
+from src.jobqueue import submit_openswath_job, claim_job, run_job, reclaim_stale_jobs
+
+REPO = Path(__file__).resolve().parents[1]
+
+# A fake OpenSwathWorkflow writing a result after FAKE_OPENSWATH_SECONDS.
+FAKE_OPENSWATH = """#!{python}
+import os, sys, time
+time.sleep(float(os.environ.get("FAKE_OPENSWATH_SECONDS", "0.2")))
+out = sys.argv[sys.argv.index("-out_tsv") + 1]
+with open(out, "w") as f:
+    f.write("transition_group_id\\tpeptide_group_label\\taggr_prec_Peak_Area\\nA_1\\tA_1\\t1\\n")
+"""
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    bin_dir = Path(tmp_path, "bin")
+    bin_dir.mkdir()
+    fake = Path(bin_dir, "OpenSwathWorkflow")
+    fake.write_text(FAKE_OPENSWATH.format(python=sys.executable))
+    fake.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.chdir(tmp_path)
+    Path("lib.tsv").write_text("CompoundName\tPrecursorMz\nA\t100\n")
+    Path("windows.tsv").write_text("start\tstop\n50\t150\n")
+    return Path(tmp_path, "queue")
+
+
+def submit(queue, n):
+    for i in range(n):
+        Path(f"sample{i}.mzML").write_text("x")
+        submit_openswath_job(queue, f"sample{i}.mzML", "lib.tsv", "windows.tsv", "10", out_dir="results")
+
+
+def test_workers_run_each_job_once(queue):
+    submit(queue, 8)
+    # separate worker processes, as on several compute nodes sharing the queue directory
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(REPO), os.environ.get("PYTHONPATH")])))
+    workers = [
+        subprocess.Popen([sys.executable, "-m", "src.jobqueue", "-queue_directory", str(queue), "-name", f"worker{i}",
+                          "-poll_interval", "0.1", "-heartbeat_interval", "0.1", "-exit_when_empty"], env=env)
+        for i in range(3)
+    ]
+    for worker in workers:
+        assert worker.wait(60) == 0
+
+    done = [json.loads(p.read_text()) for p in Path(queue, "done").glob("*.json")]
+    assert len(done) == 8
+    assert not any(Path(queue, "failed").glob("*.json"))
+    assert not any(Path(queue, "running").glob("*.json"))
+    assert len(list(Path("results").glob("*.tsv"))) == 8
+
+
+def test_reclaimed_job_is_abandoned(queue, monkeypatch):
+    monkeypatch.setenv("FAKE_OPENSWATH_SECONDS", "30")
+    submit(queue, 1)
+    job = claim_job(queue, "worker1")
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(success=run_job(queue, job, heartbeat_interval=0.1)))
+    start = time.time()
+    thread.start()
+    time.sleep(0.5)
+
+    # another worker takes the job over after a (simulated) missed heartbeat
+    assert reclaim_stale_jobs(queue, stale_timeout=-1) == [job["id"]]
+    assert claim_job(queue, "worker2")["id"] == job["id"]
+    thread.join(10)
+
+    assert not thread.is_alive() and time.time() - start < 10
+    assert result["success"] is False
+    assert json.loads(Path(queue, "running", job["id"] + ".json").read_text())["worker"] == "worker2"
+    assert not any(Path(queue, "done").glob("*.json"))
+    assert not any(Path(queue, "failed").glob("*.json"))
+
+
+def test_claimed_job_is_not_stale(queue):
+    submit(queue, 1)
+    pending = next(Path(queue, "pending").glob("*.json"))
+    os.utime(pending, (time.time() - 3600, time.time() - 3600))
+    job = claim_job(queue, "worker1")
+    assert job is not None
+    assert reclaim_stale_jobs(queue, stale_timeout=60) == []
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from src.peakpicking import integrate_peaks
+
+
+def test_gaussian_fwhm():
+    times = np.arange(0, 60, 0.5)
+    intensities = 1e5 * np.exp(-(times - 30) ** 2 / (2 * 2 ** 2))
+    peak = integrate_peaks(times, intensities[None, :]).iloc[0]
+    assert peak["apex RT"] == 30
+    assert peak["apex intensity"] == pytest.approx(1e5)
+    assert peak["FWHM"] == pytest.approx(2 * np.sqrt(2 * np.log(2)) * 2, abs=0.05)
+
+
+def test_narrow_peak():
+    times = np.arange(10, dtype=float)
+    intensities = np.array([[0, 0, 0, 500, 1000, 500, 0, 0, 0, 0]], dtype=float)
+    peak = integrate_peaks(times, intensities).iloc[0]
+    assert peak["apex RT"] == 4
+    assert peak["apex intensity"] == 1000
+    assert peak["FWHM"] == pytest.approx(2.0)
+    assert peak["area"] == pytest.approx(2000)
+
+
+def test_single_scan_peak():
+    times = np.arange(10, dtype=float)
+    intensities = np.zeros((1, 10))
+    intensities[0, 5] = 800
+    peak = integrate_peaks(times, intensities).iloc[0]
+    assert peak["apex RT"] == 5
+    assert peak["apex intensity"] == 800
+    assert peak["FWHM"] == pytest.approx(1.0)
+    assert peak["area"] == pytest.approx(800)
+
+
+def test_empty_trace():
+    peak = integrate_peaks(np.arange(10, dtype=float), np.zeros((1, 10))).iloc[0]
+    assert (peak == 0).all()
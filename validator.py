@@ -4,10 +4,16 @@ import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
 import numpy as np
-import subprocess
 import shutil
-from src.eic import get_extracted_ion_chromatogram
+from src.eic import get_eic_area_matrix, EICResult
 from src.common import show_fig, show_table
+from src.runopenswath import build_openswath_command, get_openswath_input
+from src.sweep import prepare_cached_input, parse_parameter_sets, run_parameter_sweep
+from src.common import get_session_workspace
+from src.workspace import create_job_directory, publish_directory
+from src.admission import estimate_resources, run_admitted
+from src.validation import summarize_openswath_result, build_validation_summary
+from src.swathwindows import get_swath_windows, read_swath_windows, verify_swath_windows
 import pyopenms as poms
 
 
@@ -21,6 +27,8 @@ st.markdown("""
     """, unsafe_allow_html=True)
 
 # st.set_page_config(layout="wide")
+workspace = get_session_workspace()
+results_dir = Path(workspace, "validator-results")
 mix2_001 = [f"{conc}uM_Mix2_Bioblank_pos_001" for conc in ("01", "05", "1", "5", "25")]
 
 mzML_files = st.multiselect("mzML files", [p.stem for p in Path("mzML-files").glob("*.mzML")], mix2_001)
@@ -37,55 +45,67 @@ additional = st.text_area("additional commands", """-rt_extraction_window 60
 _, c2, _ = st.columns(3)
 if c2.button("Run OpenSwathWorkflow", type="primary"):
     try:
-        with open(swath_window, "r") as f:
-            content = f.readlines()
-            start_mz = int(content[1].split("\t")[0])
-            stop_mz = int(content[-1].split("\t")[1])
-    except:
+        windows = read_swath_windows(swath_window)
+    except (ValueError, IndexError, pd.errors.ParserError, pd.errors.EmptyDataError):
         st.error("Invalid SWATH window file.")
+        st.stop()
+    start_mz, stop_mz = windows["start"].min(), windows["stop"].max()
+    # a window file not matching the acquisition would waste the whole run
+    for f in mzML_files:
+        if get_swath_windows(Path("mzML-files", f+".mzML"))[0].empty:
+            st.warning(f"No SWATH windows found in {f}, the window file is not verified.")
+    problems = [p for f in mzML_files for p in verify_swath_windows(swath_window, Path("mzML-files", f+".mzML"))]
+    if problems:
+        st.error("SWATH window file does not match the data:\n\n" + "\n\n".join(problems))
+        st.stop()
+
+    # all outputs go to a private job directory which replaces the previous results when done
+    out_dir = create_job_directory(workspace)
 
     # filter assay library for precursor mzs
     df = pd.read_csv(assay_library, sep="\t")
     df = df[df["PrecursorMz"] > start_mz]
     df = df[df["PrecursorMz"] < stop_mz]
-    assay_library = "assay-library-swath-window-filtered.tsv"
+    assay_library = str(Path(out_dir, "assay-library-swath-window-filtered.tsv"))
     df.to_csv(assay_library, sep="\t", index=False)
     with st.status("Running...", expanded=True) as status:
-        out_dir = Path("validator-results")
-        if out_dir.exists():
-            shutil.rmtree(out_dir)
-        out_dir.mkdir()
-        
-        dfs = []
+        openswath_tsvs = []
+        eic_files = []
+        eic_areas = None
         for mzML_file in mzML_files:
             st.markdown(f"**Processing file: {mzML_file}...**")
             mzML_file = str(Path("mzML-files", mzML_file+".mzML"))
-            command = ["OpenSwathWorkflow", "-in", mzML_file, "-tr", assay_library,
-                        "-out_tsv", str(Path(out_dir, Path(mzML_file).stem+".tsv")),
-                        "-out_chrom", str(Path(out_dir, Path(mzML_file).stem+"_chrom.mzML")),
-                        "-ms1_isotopes", "0",
-                        "-Scoring:TransitionGroupPicker:compute_peak_shape_metrics",
-                        "-swath_windows_file", swath_window] + additional.strip().replace("\n", " ").split(" ") + ["-force"]
-            subprocess.run(command)
+            # split files are read for the library windows only, other raw data is
+            # converted once and reused for every parameter variation
+            # (-readOptions has no effect on sqMass input, which is read from disk)
+            input_file, input_windows = get_openswath_input(mzML_file, assay_library, swath_window, out_dir)
+            if input_file == mzML_file:
+                try:
+                    input_file = prepare_cached_input(mzML_file)
+                except RuntimeError as e:
+                    st.warning(f"{e} Running OpenSWATH on the mzML file.")
+            command = build_openswath_command(input_file, assay_library, input_windows,
+                        str(Path(out_dir, Path(mzML_file).stem+".tsv")),
+                        ["-ms1_isotopes", "0",
+                         "-Scoring:TransitionGroupPicker:compute_peak_shape_metrics"] + additional.split(),
+                        out_chrom=str(Path(out_dir, Path(mzML_file).stem+"_chrom.mzML")),
+                        temp_dir=str(Path(out_dir, "tmp")))
+            estimate = estimate_resources("openswath", mzML_file, assay_library)
+            run_admitted(command, estimate, "openswath",
+                         on_wait=lambda: st.info("Waiting for memory of other running jobs..."))
 
             result_file_path = Path(out_dir, Path(mzML_file).stem+".tsv")
             if not result_file_path.exists():
                 st.warning(f"Results empty for {mzML_file}")
                 continue
-            df = pd.read_csv(result_file_path, sep="\t")
-            # df["CompoundName"] = df["peptide_group_label"] # df["transition_group_id"].apply(lambda x: x.split("_")[0])
-            # df = df.drop(columns=["transition_group_id"])
-            df = df.groupby("peptide_group_label")[["aggr_prec_Peak_Area"]].max() #.sort_values(by="aggr_prec_Peak_Area")
-            df["CompoundName"] = [x.split("_")[0] for x in df.index.tolist()]
-            df = df.groupby("CompoundName")[["aggr_prec_Peak_Area"]].mean()
-            df = df.rename(columns={"aggr_prec_Peak_Area": Path(mzML_file).stem})
+            df = summarize_openswath_result(result_file_path)
             if not df.empty:
-                dfs.append(df)
+                openswath_tsvs.append(result_file_path)
                 names = []
                 rts = []
                 intys = []
                 exp = poms.MSExperiment()
-                poms.MzMLFile().load(str(Path("validator-results", Path(mzML_file).stem +  "_chrom.mzML")), exp)
+                poms.MzMLFile().load(str(Path(out_dir, Path(mzML_file).stem +  "_chrom.mzML")), exp)
                 for chrom in exp.getChromatograms():
                     if chrom.getChromatogramType() == 3: # 3 == BASEPEAK_CHROMATOGRAM, 5 = SELECTED_REACTION_MONITORING_CHROMATOGRAM
                         name = chrom.getPrecursor().getMetaValue("peptide_sequence")
@@ -98,27 +118,46 @@ if c2.button("Run OpenSwathWorkflow", type="primary"):
                 chroms = chroms.set_index("name")
                 chroms = chroms[chroms.index.isin(df.index)]
 
-                chroms.to_pickle(Path("validator-results", f"{Path(mzML_file).stem}_chrom.pkl"))
-                
-                eic = get_extracted_ion_chromatogram(mzML_file, assay_library, 100, 60, 25)
-                eic.to_pickle(Path("validator-results", f"{Path(mzML_file).stem}_eic.pkl"))
-                eic_intys = eic[["area"]].rename(columns={"area": f"{Path(mzML_file).stem} EIC"})
-                eic_intys.index.name = "CompoundName"
-                dfs.append(eic_intys)
+                chroms.to_pickle(Path(out_dir, f"{Path(mzML_file).stem}_chrom.pkl"))
+                eic_files.append(mzML_file)
             else:
                 st.warning(f"No results for file {mzML_file}")
 
-        if dfs:
-            df = pd.concat(dfs, axis=1)
-            df = df.sort_index()
-            df.to_csv(Path("validator-results", "summary.tsv"), sep="\t")
+        if eic_files:
+            st.markdown("**Extracting ion chromatograms...**")
+            eic_areas, eics = get_eic_area_matrix(eic_files, assay_library, 100, 60, 25)
+            for name, eic in eics.items():
+                eic.save(Path(out_dir, f"{name}_eic"))
+
+        df = build_validation_summary(openswath_tsvs, eic_areas)
+        if not df.empty:
+            df.to_csv(Path(out_dir, "summary.tsv"), sep="\t")
             st.write("✅ Done combining results.")
             show_table(df, "combined-intensities")
             status.update(label="✅ Complete!", state="complete", expanded=False)
         else:
             status.update(label="No results with selected settings.", state="error")
+        shutil.rmtree(Path(out_dir, "tmp"), ignore_errors=True)
+        publish_directory(out_dir, results_dir)
+
+with st.expander("Parameter sweep"):
+    sweep_sets = st.text_area("parameter sets (separated by lines with ---)", additional + "---\n" + additional, height=300)
+    if st.button("Run parameter sweep"):
+        bar = st.progress(0.0, "Running...")
+        sweep_dir = create_job_directory(workspace)
+        runs = run_parameter_sweep([str(Path("mzML-files", f+".mzML")) for f in mzML_files], assay_library, swath_window,
+                                   [["-ms1_isotopes", "0"] + p for p in parse_parameter_sets(sweep_sets)],
+                                   str(sweep_dir),
+                                   progress=lambda i, n, run: bar.progress(i / n, f"{run['file']} set {run['parameter set']} ({i}/{n})"))
+        dfs = [summarize_openswath_result(run["out_tsv"], f"{run['file']} set {run['parameter set']}")
+               for _, run in runs[runs["success"]].iterrows()]
+        dfs = [df for df in dfs if not df.empty]
+        show_table(runs, "sweep-runs")
+        if dfs:
+            show_table(pd.concat(dfs, axis=1).sort_index(), "sweep-intensities")
+        publish_directory(sweep_dir, Path(workspace, "sweep-results"))
 
-path = Path("validator-results", "summary.tsv")
+path = Path(results_dir, "summary.tsv")
 if path.exists():
     df = pd.read_csv(path, sep="\t", index_col="CompoundName")
 else:
@@ -137,15 +176,16 @@ if not df.empty:
     fig = px.bar(df, barmode="group")
     show_fig(fig, "summary-fig")
 
-if any(Path("validator-results").glob("*_chrom.pkl")):
+if any(results_dir.glob("*_chrom.pkl")):
     c1, c2 = st.columns(2)
-    file = c1.selectbox("show chromatograms for file", [f.stem[:-6] for f in Path("validator-results").glob("*_chrom.mzML")])
-    df_openswath = pd.read_pickle(Path("validator-results", file+"_chrom.pkl"))
+    file = c1.selectbox("show chromatograms for file", [f.stem[:-6] for f in results_dir.glob("*_chrom.mzML")])
+    df_openswath = pd.read_pickle(Path(results_dir, file+"_chrom.pkl"))
     metabolite_options = df_openswath.index
-    eic_path = Path("validator-results", file+"_eic.pkl")
+    eic_path = Path(results_dir, file+"_eic")
+    eic = None
     if eic_path.exists():
-        df_eic = pd.read_pickle(eic_path)
-        metabolite_options = df_eic.index
+        eic = EICResult.load(eic_path)
+        metabolite_options = eic.compounds.index
     metabolite = c2.selectbox("metabolite", sorted(metabolite_options))
 
     # Add OpenSWATH chromatogram
@@ -163,12 +203,11 @@ if any(Path("validator-results").glob("*_chrom.pkl")):
     else:
         st.warning(f"No OpenSWATH result for {metabolite}")
     # Add EIC chromatogram
-    df = df_eic[df_eic.index == metabolite]
-    if not df.empty:
+    if eic is not None and metabolite in eic.compounds.index:
         fig.add_trace(
             go.Scatter(
-                x=df["times"][0],
-                y=df["intensities"][0],
+                x=eic.times,
+                y=eic.trace(metabolite),
                 name="EIC",
                 line={"color": "#ef553b"}
             )